@@ -0,0 +1,7 @@
+#!/bin/sh
+# Adds an index on when events finish, for calendar date-range queries
+cp $1 $1.bak
+
+QUERY="CREATE INDEX IF NOT EXISTS events_finish_dt ON events(COALESCE(event_end_dt, event_dt))"
+
+uv run python -m sqlite3 $1 "$QUERY"
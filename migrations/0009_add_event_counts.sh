@@ -0,0 +1,56 @@
+#!/bin/sh
+# Adds an event_counts table, kept up to date from attendees by triggers
+cp $1 $1.bak
+
+# Recounts the attendees of the event referenced by $1 (NEW or OLD)
+recount() {
+    echo "INSERT INTO event_counts (event_id, num_attending, num_waiting, num_paid)
+        SELECT
+            $1.event_id,
+            COUNT(*) FILTER (WHERE NOT is_waiting_list),
+            COUNT(*) FILTER (WHERE is_waiting_list),
+            COUNT(*) FILTER (WHERE is_trip_paid AND NOT is_waiting_list)
+        FROM attendees
+        WHERE event_id = $1.event_id
+        ON CONFLICT(event_id) DO UPDATE SET
+            num_attending = excluded.num_attending,
+            num_waiting = excluded.num_waiting,
+            num_paid = excluded.num_paid;"
+}
+
+QUERY="CREATE TABLE event_counts (
+    event_id INTEGER PRIMARY KEY,
+    num_attending INTEGER NOT NULL DEFAULT 0,
+    num_waiting INTEGER NOT NULL DEFAULT 0,
+    num_paid INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY(event_id) REFERENCES events(id)
+)"
+
+uv run python -m sqlite3 $1 "$QUERY"
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS attendees_event_id ON attendees(event_id)"
+
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_insert AFTER INSERT ON attendees
+BEGIN
+    $(recount NEW)
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_update
+AFTER UPDATE OF is_waiting_list, is_trip_paid ON attendees
+BEGIN
+    $(recount NEW)
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_delete AFTER DELETE ON attendees
+BEGIN
+    $(recount OLD)
+END"
+
+# Backfill from existing attendees
+QUERY="INSERT INTO event_counts (event_id, num_attending, num_waiting, num_paid)
+SELECT
+    event_id,
+    COUNT(*) FILTER (WHERE NOT is_waiting_list),
+    COUNT(*) FILTER (WHERE is_waiting_list),
+    COUNT(*) FILTER (WHERE is_trip_paid AND NOT is_waiting_list)
+FROM attendees
+GROUP BY event_id"
+
+uv run python -m sqlite3 $1 "$QUERY"
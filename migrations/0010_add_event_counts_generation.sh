@@ -0,0 +1,40 @@
+#!/bin/sh
+# Adds a generation to event_counts, bumped on every attendee change
+cp $1 $1.bak
+
+# As in 0009, but also bumps the generation
+recount() {
+    echo "INSERT INTO event_counts (event_id, num_attending, num_waiting, num_paid)
+        SELECT
+            $1.event_id,
+            COUNT(*) FILTER (WHERE NOT is_waiting_list),
+            COUNT(*) FILTER (WHERE is_waiting_list),
+            COUNT(*) FILTER (WHERE is_trip_paid AND NOT is_waiting_list)
+        FROM attendees
+        WHERE event_id = $1.event_id
+        ON CONFLICT(event_id) DO UPDATE SET
+            num_attending = excluded.num_attending,
+            num_waiting = excluded.num_waiting,
+            num_paid = excluded.num_paid,
+            generation = generation + 1;"
+}
+
+uv run python -m sqlite3 $1 "ALTER TABLE event_counts ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"
+
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS attendees_counts_insert"
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS attendees_counts_update"
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS attendees_counts_delete"
+
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_insert AFTER INSERT ON attendees
+BEGIN
+    $(recount NEW)
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_update
+AFTER UPDATE OF is_waiting_list, is_trip_paid ON attendees
+BEGIN
+    $(recount NEW)
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_counts_delete AFTER DELETE ON attendees
+BEGIN
+    $(recount OLD)
+END"
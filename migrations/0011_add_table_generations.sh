@@ -0,0 +1,27 @@
+#!/bin/sh
+# Adds a table_generations table, bumped by triggers on any change to each table
+cp $1 $1.bak
+
+NOW="strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+QUERY="CREATE TABLE table_generations (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    updated_utc DATETIME NOT NULL
+)"
+
+uv run python -m sqlite3 $1 "$QUERY"
+
+for TABLE in events attendees users albums photos; do
+    uv run python -m sqlite3 $1 "INSERT INTO table_generations (name, updated_utc) VALUES ('$TABLE', $NOW)"
+
+    for OP in INSERT UPDATE DELETE; do
+        NAME=$(echo "${TABLE}_generation_${OP}" | tr 'A-Z' 'a-z')
+        uv run python -m sqlite3 $1 "CREATE TRIGGER $NAME AFTER $OP ON $TABLE
+        BEGIN
+            UPDATE table_generations
+            SET generation = generation + 1, updated_utc = $NOW
+            WHERE name = '$TABLE';
+        END"
+    done
+done
@@ -0,0 +1,40 @@
+#!/bin/sh
+# Adds a trial_tallies table, counted lazily by the app and cleared by triggers
+cp $1 $1.bak
+
+QUERY="CREATE TABLE trial_tallies (
+    user_id INTEGER PRIMARY KEY,
+    num_trial_events INTEGER NOT NULL DEFAULT 0,
+    stale_on DATE,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+)"
+
+uv run python -m sqlite3 $1 "$QUERY"
+
+# Any change to someone's attendance means their tally needs recounting
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_trial_insert AFTER INSERT ON attendees
+BEGIN
+    DELETE FROM trial_tallies WHERE user_id = NEW.user_id;
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_trial_update
+AFTER UPDATE OF user_id, event_id, is_waiting_list ON attendees
+BEGIN
+    DELETE FROM trial_tallies WHERE user_id IN (OLD.user_id, NEW.user_id);
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_trial_delete AFTER DELETE ON attendees
+BEGIN
+    DELETE FROM trial_tallies WHERE user_id = OLD.user_id;
+END"
+
+# As does moving, retyping or deleting an event they're going to
+uv run python -m sqlite3 $1 "CREATE TRIGGER events_trial_update
+AFTER UPDATE OF event_dt, event_end_dt, event_type, is_deleted ON events
+BEGIN
+    DELETE FROM trial_tallies
+    WHERE user_id IN (SELECT user_id FROM attendees WHERE event_id = NEW.id);
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER events_trial_delete AFTER DELETE ON events
+BEGIN
+    DELETE FROM trial_tallies
+    WHERE user_id IN (SELECT user_id FROM attendees WHERE event_id = OLD.id);
+END"
@@ -0,0 +1,6 @@
+#!/bin/sh
+# Adds pre-rendered HTML to pages. Existing pages are rendered by the app when
+# first read, as that needs mistune.
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "ALTER TABLE pages ADD COLUMN html TEXT"
@@ -0,0 +1,46 @@
+#!/bin/sh
+# Adds a user_events_generations table, bumped by triggers whenever anything in a
+# user's own list of events changes
+cp $1 $1.bak
+
+NOW="strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+# Bumps the generation for users selected by $1
+bump() {
+    echo "INSERT INTO user_events_generations (user_id, generation, updated_utc)
+        SELECT user_id, 1, $NOW FROM ($1) WHERE true
+        ON CONFLICT(user_id) DO UPDATE SET
+            generation = generation + 1,
+            updated_utc = excluded.updated_utc;"
+}
+
+QUERY="CREATE TABLE user_events_generations (
+    user_id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    updated_utc DATETIME NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+)"
+
+uv run python -m sqlite3 $1 "$QUERY"
+
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_user_events_insert AFTER INSERT ON attendees
+BEGIN
+    $(bump "SELECT NEW.user_id AS user_id")
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_user_events_update AFTER UPDATE ON attendees
+BEGIN
+    $(bump "SELECT OLD.user_id AS user_id UNION SELECT NEW.user_id")
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER attendees_user_events_delete AFTER DELETE ON attendees
+BEGIN
+    $(bump "SELECT OLD.user_id AS user_id")
+END"
+
+uv run python -m sqlite3 $1 "CREATE TRIGGER events_user_events_update AFTER UPDATE ON events
+BEGIN
+    $(bump "SELECT user_id FROM attendees WHERE event_id = NEW.id")
+END"
+uv run python -m sqlite3 $1 "CREATE TRIGGER events_user_events_delete AFTER DELETE ON events
+BEGIN
+    $(bump "SELECT user_id FROM attendees WHERE event_id = OLD.id")
+END"
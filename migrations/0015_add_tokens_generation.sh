@@ -0,0 +1,19 @@
+#!/bin/sh
+# Adds the tokens table to table_generations, so cached sessions know when a
+# token is removed (see migrations/0011)
+cp $1 $1.bak
+
+NOW="strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+TABLE=tokens
+
+uv run python -m sqlite3 $1 "INSERT INTO table_generations (name, updated_utc) VALUES ('$TABLE', $NOW)"
+
+for OP in INSERT UPDATE DELETE; do
+    NAME=$(echo "${TABLE}_generation_${OP}" | tr 'A-Z' 'a-z')
+    uv run python -m sqlite3 $1 "CREATE TRIGGER $NAME AFTER $OP ON $TABLE
+    BEGIN
+        UPDATE table_generations
+        SET generation = generation + 1, updated_utc = $NOW
+        WHERE name = '$TABLE';
+    END"
+done
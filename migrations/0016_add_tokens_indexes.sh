@@ -0,0 +1,6 @@
+#!/bin/sh
+# Indexes tokens for looking up a user's sessions, and for sweeping expired ones
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS tokens_user_id ON tokens(user_id)"
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS tokens_expiry_utc ON tokens(expiry_utc)"
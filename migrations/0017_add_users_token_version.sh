@@ -0,0 +1,5 @@
+#!/bin/sh
+# Adds users.token_version, bumped to revoke a user's stateless sessions
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"
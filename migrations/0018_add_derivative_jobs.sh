@@ -0,0 +1,20 @@
+#!/bin/sh
+# Adds a queue of thumbnails to make in the background, and queues any missing
+cp $1 $1.bak
+
+QUERY="CREATE TABLE derivative_jobs (
+    id INTEGER PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    created_utc DATETIME NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_until_utc DATETIME,
+    UNIQUE(source_path, width)
+)"
+
+uv run python -m sqlite3 $1 "$QUERY"
+
+# Any already made are skipped by the worker straight away
+uv run python -m sqlite3 $1 "INSERT INTO derivative_jobs (source_path, width, created_utc)
+SELECT photo_path, widths.value, datetime('now')
+FROM photos, json_each('[128, 300]') AS widths"
@@ -0,0 +1,9 @@
+#!/bin/sh
+# Queues the new sizes and WebP/AVIF copies of every existing photo
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "INSERT INTO derivative_jobs (source_path, width, created_utc)
+SELECT photo_path, widths.value, datetime('now')
+FROM photos, json_each('[128, 300, 600, 1280, 1920]') AS widths
+WHERE true
+ON CONFLICT DO NOTHING"
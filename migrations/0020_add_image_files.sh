@@ -0,0 +1,30 @@
+#!/bin/sh
+# Adds the image_files table, recording every resized copy of an upload so pages
+# needn't check the disk. Existing files are recorded by
+# scripts/record_image_files.py, which should be run after this.
+cp $1 $1.bak
+
+NOW="strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+TABLE=image_files
+
+uv run python -m sqlite3 $1 "CREATE TABLE $TABLE (
+    path TEXT PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    format TEXT NOT NULL
+)"
+uv run python -m sqlite3 $1 "CREATE INDEX image_files_source_path ON $TABLE(source_path)"
+
+uv run python -m sqlite3 $1 "INSERT INTO table_generations (name, updated_utc) VALUES ('$TABLE', $NOW)"
+
+for OP in INSERT UPDATE DELETE; do
+    NAME=$(echo "${TABLE}_generation_${OP}" | tr 'A-Z' 'a-z')
+    uv run python -m sqlite3 $1 "CREATE TRIGGER $NAME AFTER $OP ON $TABLE
+    BEGIN
+        UPDATE table_generations
+        SET generation = generation + 1, updated_utc = $NOW
+        WHERE name = '$TABLE';
+    END"
+done
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Indexes photos by album, in upload order, for the album index and pages
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS photos_album_id_created_at_utc ON photos(album_id, created_at_utc)"
@@ -0,0 +1,8 @@
+#!/bin/sh
+# Adds perceptual hashes to photos, for spotting near duplicates on upload, and
+# indexes photos by path, for finding earlier uploads of the same content.
+# Hashes of existing photos are taken by scripts/hash_photos.py.
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "ALTER TABLE photos ADD COLUMN perceptual_hash INTEGER"
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS photos_photo_path ON photos(photo_path)"
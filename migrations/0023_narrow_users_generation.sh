@@ -0,0 +1,34 @@
+#!/bin/sh
+# Stops logins and password changes bumping the users generation (see
+# migrations/0011), as no cached page shows them. Otherwise every login would
+# change the ETag of every events, album and member page. Last logins get their
+# own user_logins generation instead, for the member pages that show them.
+# Also indexes when events were last edited, for their ETags.
+cp $1 $1.bak
+
+NOW="strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+
+bump() {
+    echo "UPDATE table_generations
+        SET generation = generation + 1, updated_utc = $NOW
+        WHERE name = '$1';"
+}
+
+COLUMNS="slug, email, first_name, last_name, about, mobile, in_case_emergency,
+    profile_picture_url, is_admin, is_committee, is_coordinator, is_winter_skills,
+    discord_id, membership_expiry, is_dormant, committee_role, committee_bio,
+    created_on_utc"
+
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS users_generation_update"
+uv run python -m sqlite3 $1 "CREATE TRIGGER users_generation_update AFTER UPDATE OF $COLUMNS ON users
+BEGIN
+    $(bump users)
+END"
+
+uv run python -m sqlite3 $1 "INSERT INTO table_generations (name, updated_utc) VALUES ('user_logins', $NOW)"
+uv run python -m sqlite3 $1 "CREATE TRIGGER user_logins_generation_update AFTER UPDATE OF last_login_utc ON users
+BEGIN
+    $(bump user_logins)
+END"
+
+uv run python -m sqlite3 $1 "CREATE INDEX IF NOT EXISTS events_updated_on_utc ON events(updated_on_utc)"
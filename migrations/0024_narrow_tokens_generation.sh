@@ -0,0 +1,8 @@
+#!/bin/sh
+# Only bumps the tokens generation (see migrations/0015) when tokens are removed.
+# Cached sessions are keyed by token, so a new login can't make any stale, and
+# bumping on every login would empty the session cache in every worker.
+cp $1 $1.bak
+
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS tokens_generation_insert"
+uv run python -m sqlite3 $1 "DROP TRIGGER IF EXISTS tokens_generation_update"
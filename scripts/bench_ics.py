@@ -0,0 +1,122 @@
+"""
+Benchmarks serving /ics/calendar.ics against a throwaway DB of many events.
+
+Reports the time per poll when the feed is built from scratch, served from the
+cache, and answered with a 304, along with how many polls an hour one worker
+could serve at each.
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from mountains.db import connection
+from mountains.models.events import Event, EventType, events_repo
+from mountains.models.generations import TableGeneration, table_generations_repo
+from mountains.models.tokens import ICSToken, tokens_ics_repo
+from mountains.models.users import User, users_repo
+from mountains.utils import now_utc
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--events", type=int, default=3000, help="Number of events")
+parser.add_argument("--polls", type=int, default=2000, help="Polls per benchmark")
+args = parser.parse_args()
+
+db_name = str(Path(tempfile.mkdtemp()) / "bench.db")
+now = now_utc()
+
+with connection(db_name, locked=True) as conn:
+    for repo in [users_repo, events_repo, tokens_ics_repo, table_generations_repo]:
+        repo(conn).create_table()
+
+    users_repo(conn).insert(
+        User(
+            id=1,
+            slug="bench",
+            email="bench@example.org",
+            password_hash="",
+            first_name="Bench",
+            last_name="Mark",
+            about=None,
+        )
+    )
+    token = ICSToken.from_id(1)
+    tokens_ics_repo(conn).insert(token)
+    table_generations_repo(conn).insert(
+        TableGeneration(name="events", generation=0, updated_utc=now)
+    )
+
+    # Spread events either side of today, so most are in the feed
+    for i in range(args.events):
+        event_dt = now + datetime.timedelta(days=i - args.events // 4, hours=9)
+        events_repo(conn).insert(
+            Event(
+                id=i + 1,
+                slug=f"bench-{i + 1}",
+                title=f"Benchmark Event {i + 1}",
+                description="",
+                event_dt=event_dt,
+                event_end_dt=event_dt + datetime.timedelta(hours=8),
+                event_type=EventType.SUMMER_DAY_WALK,
+                created_on_utc=now,
+                updated_on_utc=now,
+                max_attendees=None,
+                show_participation_ice=False,
+                signup_open_dt=None,
+                is_members_only=False,
+                is_draft=False,
+                is_deleted=False,
+                is_locked=False,
+                map_path=None,
+                price_id=None,
+            )
+        )
+
+os.environ["FLASK_DB_NAME"] = db_name
+os.environ["FLASK_STATIC_FOLDER"] = tempfile.mkdtemp()
+os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+# The bench DB has no tables for the background threads to work on
+os.environ["FLASK_CMC_DERIVATIVE_POLL_SECS"] = "0"
+os.environ["FLASK_CMC_TOKEN_SWEEP_SECS"] = "0"
+
+# Imported once the environment is set up for them
+from mountains import create_app
+from mountains.ics import _feeds
+
+client = create_app().test_client()
+url = f"/ics/calendar.ics?token={token.id}"
+
+
+def bench(name: str, poll, num_polls: int) -> None:
+    start = time.perf_counter()
+    for _ in range(num_polls):
+        poll()
+    secs = (time.perf_counter() - start) / num_polls
+    print(f"{name:<12} {secs * 1000:8.2f}ms/poll {3600 / secs:12,.0f} polls/hour")
+
+
+def uncached():
+    _feeds.clear()
+    assert client.get(url).status_code == 200
+
+
+def cached():
+    assert client.get(url).status_code == 200
+
+
+response = client.get(url)
+print(f"{args.events} events, {len(response.data):,} byte feed")
+
+
+def not_modified():
+    headers = {"If-None-Match": response.headers["ETag"]}
+    assert client.get(url, headers=headers).status_code == 304
+
+
+# Building is slow, so don't wait for as many of those
+bench("uncached", uncached, max(1, args.polls // 20))
+bench("cached", cached, args.polls)
+bench("304", not_modified, args.polls)
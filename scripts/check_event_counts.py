@@ -0,0 +1,23 @@
+import argparse
+
+from mountains.db import connection
+from mountains.models.events import check_event_counts, rebuild_event_counts
+
+parser = argparse.ArgumentParser()
+parser.add_argument("target_db", help="SQL DB to target")
+parser.add_argument(
+    "--rebuild", action="store_true", help="Recount everything if any differ"
+)
+
+args = parser.parse_args()
+
+with connection(args.target_db, locked=True) as conn:
+    mismatches = check_event_counts(conn)
+    for stored, actual in mismatches:
+        print(f"Event {actual.event_id}: stored {stored!r}, actual {actual!r}")
+    print(f"Found {len(mismatches)} events with incorrect counts.")
+
+    if mismatches and args.rebuild:
+        print("Rebuilding all event counts...")
+        rebuild_event_counts(conn)
+        print(f"Now {len(check_event_counts(conn))} events with incorrect counts.")
@@ -0,0 +1,30 @@
+import argparse
+from pathlib import Path
+
+from mountains import images
+from mountains.db import connection
+from mountains.models.photos import photos_repo
+
+parser = argparse.ArgumentParser(
+    description="Takes the perceptual hashes of photos uploaded before they were"
+    " taken on upload (see migrations/0022)"
+)
+parser.add_argument("target_db", help="SQL DB to target")
+parser.add_argument("static_dir", help="The app's static folder")
+
+args = parser.parse_args()
+static_dir = Path(args.static_dir)
+
+with connection(args.target_db) as conn:
+    photos = photos_repo(conn).select("perceptual_hash IS NULL")
+
+hashes = []
+for photo in photos:
+    try:
+        hashes.append((images.perceptual_hash(static_dir / photo.photo_path), photo.id))
+    except OSError as e:
+        print(f"Skipping photo {photo.id}: {e}")
+
+with connection(args.target_db, locked=True) as conn:
+    conn.executemany("UPDATE photos SET perceptual_hash = ? WHERE id = ?", hashes)
+print(f"Hashed {len(hashes)} of {len(photos)} photos.")
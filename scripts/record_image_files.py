@@ -0,0 +1,45 @@
+import argparse
+from pathlib import Path
+
+from mountains import images
+from mountains.db import connection
+from mountains.models.image_files import ImageFile, record_image_files
+from mountains.models.kit import kit_details_repo
+from mountains.models.photos import photo_file_paths, photos_repo
+from mountains.models.users import profile_file_paths, users_repo
+
+parser = argparse.ArgumentParser(
+    description="Records the image files already on disk, made before they were"
+    " recorded as they're saved (see migrations/0020)"
+)
+parser.add_argument("target_db", help="SQL DB to target")
+parser.add_argument("static_dir", help="The app's static folder")
+
+args = parser.parse_args()
+static_dir = Path(args.static_dir)
+
+with connection(args.target_db) as conn:
+    sources = [
+        (p.photo_path, photo_file_paths(p.photo_path)) for p in photos_repo(conn).list()
+    ]
+    sources.extend(
+        (Path(u.profile_picture_url), profile_file_paths(Path(u.profile_picture_url)))
+        for u in users_repo(conn).list()
+        if u.profile_picture_url is not None
+    )
+    sources.extend(
+        (Path(k.photo_path), k.image_file_paths())
+        for k in kit_details_repo(conn).list()
+        if k.photo_path is not None
+    )
+
+files = []
+for source_path, paths in sources:
+    for path in paths:
+        if (static_dir / path).exists():
+            saved = images.describe(static_dir / path)
+            files.append(ImageFile.from_saved(static_dir, source_path, saved))
+
+with connection(args.target_db, locked=True) as conn:
+    record_image_files(conn, files)
+print(f"Recorded {len(files)} files from {len(sources)} uploads.")
@@ -0,0 +1,220 @@
+"""
+Moves photos and profile pictures uploaded before uploads were sharded into
+their sharded directories (see `mountains.utils.sharded_path`).
+
+Safe to run while the site is up, and to rerun. Files are moved in batches,
+each of which is:
+
+1. Linked into its new directory, so both paths work.
+2. Recorded there, in one transaction per batch.
+
+Photos whose copies are being made by the background worker right now are left
+for the next run.
+
+The old files are kept, as pages rendered before the move (and still open in
+browsers, or cached) link to them. Once those have all expired, e.g. a day
+later, run again with --unlink to remove them.
+"""
+
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+from mountains.db import connection
+from mountains.models.photos import (
+    UPLOADS_DIR,
+    move_photo,
+    photo_file_paths,
+    photos_repo,
+)
+from mountains.models.users import (
+    PROFILE_DIR,
+    move_profile,
+    profile_file_paths,
+    users_repo,
+)
+from mountains.utils import now_utc, sharded_path
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("target_db", help="SQL DB to target")
+parser.add_argument("static_dir", help="The app's static folder")
+parser.add_argument(
+    "--batch-size", type=int, default=200, help="Uploads to move per transaction"
+)
+parser.add_argument(
+    "--unlink",
+    action="store_true",
+    help="Remove the old files of uploads already moved, rather than moving more",
+)
+
+args = parser.parse_args()
+static_dir = Path(args.static_dir)
+
+
+def link_files(moves: list[tuple[Path, Path]]) -> None:
+    for old, new in moves:
+        if (static_dir / new).exists() or not (static_dir / old).exists():
+            continue
+        (static_dir / new).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(static_dir / old, static_dir / new)
+        except OSError:
+            shutil.copy2(static_dir / old, static_dir / new)
+
+
+def unlink_files(moves: list[tuple[Path, Path]]) -> int:
+    num_unlinked = 0
+    for old, new in moves:
+        if (static_dir / new).exists() and (static_dir / old).exists():
+            (static_dir / old).unlink()
+            num_unlinked += 1
+    return num_unlinked
+
+
+# Photos whose copies the background worker is making right now
+CLAIMED_QUERY = "SELECT source_path FROM derivative_jobs WHERE claimed_until_utc > :now"
+
+
+def shard_photos() -> tuple[int, int]:
+    """
+    Moves a batch of photos. Returns how many were found to move, and how many
+    were moved.
+    """
+    with connection(args.target_db) as conn:
+        photos = photos_repo(conn).select(
+            f"""
+            photo_path LIKE :flat AND photo_path NOT LIKE :sharded
+            AND photo_path NOT IN ({CLAIMED_QUERY})
+            """,
+            {
+                "flat": f"{UPLOADS_DIR}/%",
+                "sharded": f"{UPLOADS_DIR}/%/%",
+                "now": now_utc().isoformat(),
+            },
+            order_by="id",
+            limit=args.batch_size,
+        )
+    new_paths = {
+        p.photo_path: sharded_path(UPLOADS_DIR, Path(p.photo_path.name)) for p in photos
+    }
+    moves = {
+        photo_path: list(
+            zip(photo_file_paths(photo_path), photo_file_paths(new_path), strict=True)
+        )
+        for photo_path, new_path in new_paths.items()
+    }
+
+    link_files([m for photo_moves in moves.values() for m in photo_moves])
+    with connection(args.target_db, locked=True) as conn:
+        # The worker may have claimed some since, and would record their copies
+        # under the old path, so they wait for the next run
+        claimed = {
+            row[0]
+            for row in conn.execute(CLAIMED_QUERY, {"now": now_utc().isoformat()})
+        }
+        skipped = [p for p in new_paths if str(p) in claimed]
+        for photo_path, new_path in new_paths.items():
+            if photo_path not in skipped:
+                move_photo(conn, photo_path, new_path)
+    for photo_path in skipped:
+        for _, new in moves[photo_path]:
+            (static_dir / new).unlink(missing_ok=True)
+    return len(new_paths), len(new_paths) - len(skipped)
+
+
+def shard_profiles() -> tuple[int, int]:
+    """
+    Moves a batch of profile pictures. Returns how many were found to move, and
+    how many were moved.
+    """
+    with connection(args.target_db) as conn:
+        users = users_repo(conn).select(
+            "profile_picture_url LIKE :flat AND profile_picture_url NOT LIKE :sharded",
+            {"flat": f"{PROFILE_DIR}/%", "sharded": f"{PROFILE_DIR}/%/%"},
+            order_by="id",
+            limit=args.batch_size,
+        )
+    new_paths = {}
+    moves = []
+    for user in users:
+        assert user.profile_picture_url is not None
+        profile_path = Path(user.profile_picture_url)
+        new_paths[user.id] = sharded_path(PROFILE_DIR, Path(profile_path.name))
+        moves.extend(
+            (path, new_paths[user.id].parent / path.name)
+            for path in profile_file_paths(profile_path)
+        )
+
+    link_files(moves)
+    with connection(args.target_db, locked=True) as conn:
+        for user in users:
+            move_profile(conn, user, new_paths[user.id])
+    return len(users), len(users)
+
+
+def unlink_moved() -> int:
+    """
+    Removes the old files of every upload that has been moved. Returns how many.
+
+    Names are content hashes, so a photo or picture not yet moved can share its
+    old path with one that has, and keeps its files.
+    """
+    with connection(args.target_db) as conn:
+        flat_paths = {
+            p.photo_path
+            for p in photos_repo(conn).select(
+                "photo_path NOT LIKE :sharded", {"sharded": f"{UPLOADS_DIR}/%/%"}
+            )
+        } | {
+            Path(u.profile_picture_url)
+            for u in users_repo(conn).select(
+                "profile_picture_url NOT LIKE :sharded",
+                {"sharded": f"{PROFILE_DIR}/%/%"},
+            )
+            if u.profile_picture_url is not None
+        }
+        photo_paths = {
+            p.photo_path
+            for p in photos_repo(conn).select(
+                "photo_path LIKE :sharded", {"sharded": f"{UPLOADS_DIR}/%/%"}
+            )
+        }
+        profile_paths = {
+            Path(u.profile_picture_url)
+            for u in users_repo(conn).select(
+                "profile_picture_url LIKE :sharded", {"sharded": f"{PROFILE_DIR}/%/%"}
+            )
+            if u.profile_picture_url is not None
+        }
+
+    moves = []
+    for photo_path in photo_paths:
+        old_path = UPLOADS_DIR / photo_path.name
+        if old_path in flat_paths:
+            continue
+        moves.extend(zip(photo_file_paths(old_path), photo_file_paths(photo_path)))
+    for profile_path in profile_paths:
+        old_path = PROFILE_DIR / profile_path.name
+        if old_path in flat_paths:
+            continue
+        moves.extend(
+            zip(profile_file_paths(old_path), profile_file_paths(profile_path))
+        )
+    return unlink_files(moves)
+
+
+if args.unlink:
+    print(f"Removed {unlink_moved()} old files.")
+else:
+    for name, shard in [("photos", shard_photos), ("profile pictures", shard_profiles)]:
+        num_moved = 0
+        # Keeps going while any are found, as a batch can be skipped entirely
+        while True:
+            num_found, num_moved_now = shard()
+            if not num_found:
+                break
+            num_moved += num_moved_now
+            print(f"Moved {num_moved} {name}...")
+        print(f"Moved {num_moved} {name}.")
+    print("Run again with --unlink once pages from before now have expired.")
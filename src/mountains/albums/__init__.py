@@ -16,41 +16,66 @@ from flask import (
     url_for,
 )
 
-from mountains.context import current_user, db_conn
-from mountains.models.photos import Album, Photo, albums_repo, photos_repo, upload_photo
-from mountains.models.users import User, users_repo
+from mountains.conditional import conditional_get
+from mountains.context import current_user, db_conn, photo_processor
+from mountains.models.image_files import image_files_for, record_image_files
+from mountains.models.photos import (
+    Album,
+    Photo,
+    adjacent_photos,
+    album_photos_page,
+    album_summaries,
+    albums_repo,
+    find_duplicate,
+    photos_repo,
+)
+from mountains.models.users import users_repo
 from mountains.utils import str_to_bool
 
 if TYPE_CHECKING:
     from sqlite3 import Connection
 
+    from mountains.uploads import UploadResult
+
 logger = logging.getLogger(__name__)
 
+# Most photos loaded at once as the gallery is scrolled. The album page itself can
+# show more, as without JS "Show More" reloads it with everything shown so far.
+MAX_PAGE_SIZE = 100
+
 blueprint = Blueprint(
     "albums", __name__, template_folder="templates", static_folder="static"
 )
 
 
 @blueprint.route("/")
+@conditional_get("albums", "photos", "users", "image_files")
 def albums():
     num_shown = request.args.get("num_shown", type=int, default=10)
     with db_conn() as conn:
-        albums = sorted(
-            albums_repo(conn).list(), key=lambda a: a.created_at_utc, reverse=True
-        )[:num_shown]
-        album_photos: dict[int, list[Photo]] = {}
-        album_users: dict[int, list[User]] = {}
-        for album in albums:
-            album_photos[album.id] = photos_repo(conn).list_where(album_id=album.id)
-            contributors = set(p.uploader_id for p in album_photos[album.id])
-            album_users[album.id] = users_repo(conn).get_all(id=contributors)
+        summaries = album_summaries(conn, limit=num_shown)
+        users = {
+            u.id: u
+            for u in users_repo(conn).get_all(
+                id={i for s in summaries for i in s.contributor_ids}
+            )
+        }
+    album_users = {
+        s.album.id: [users[i] for i in s.contributor_ids if i in users]
+        for s in summaries
+    }
+    # Every picture on the page, looked up at once rather than as each is shown
+    image_files = image_files_for(
+        [p.photo_path for s in summaries for p in s.covers]
+        + [Path(u.profile_picture_url) for u in users.values() if u.profile_picture_url]
+    )
 
     return render_template(
         "albums/albums.html.j2",
-        albums=albums,
-        album_photos=album_photos,
+        summaries=summaries,
         album_users=album_users,
         num_shown=num_shown,
+        image_files=image_files,
     )
 
 
@@ -77,61 +102,146 @@ def add_album():
 
 
 @blueprint.route("/<int:id>/", methods=["GET", "POST"])
+@conditional_get("albums", "photos", "users", "image_files")
 def album(id: int):
     with db_conn() as conn:
         album = albums_repo(conn).get_or_404(id=id)
 
     if request.method == "POST":
         # Photo Upload
+        files = [f for f in request.files.getlist("photos") if f.filename]
+        results = photo_processor().process(
+            files, Path(current_app.config["STATIC_FOLDER"])
+        )
+        errors = [r.error for r in results if r.error is not None]
+
         new_photos = []
-        for file in request.files.getlist("photos"):
-            if file.filename:
-                photo_path = upload_photo(
-                    file, Path(current_app.config["STATIC_FOLDER"])
-                )
-
-                with db_conn(locked=True) as conn:
-                    photos_db = photos_repo(conn)
-                    photo = Photo(
-                        id=photos_db.next_id(),
-                        uploader_id=g.current_user.id,
-                        album_id=id,
-                        starred=False,
-                        photo_path=photo_path,
-                    )
-                    photos_db.insert(photo)
-
-                new_photos.append(photo)
+        if uploaded := [r for r in results if r.photo_path is not None]:
+            with db_conn(locked=True) as conn:
+                new_photos = _add_uploads(conn, album, uploaded, errors)
+                record_image_files(conn, (f for r in uploaded for f in r.image_files))
 
         if request.headers.get("HX-Target") == "gallery":
             return render_template(
                 "albums/album._gallery.html.j2",
                 album=album,
                 photos=new_photos,
+                image_files=image_files_for(p.photo_path for p in new_photos),
+                uploaders={g.current_user.id: g.current_user},
+                errors=errors,
             )
         else:
             return redirect(url_for(".album", id=album.id))
 
-    limit = request.args.get("limit", type=int, default=5)
+    limit = request.args.get("limit", type=int, default=20)
     with db_conn() as conn:
-        photos = sorted(
-            photos_repo(conn).list_where(album_id=album.id),
-            key=lambda p: p.created_at_utc,
-        )
-
-        users = users_repo(conn).get_all(id=set(p.uploader_id for p in photos))
-        user_map = {u.id: u for u in users}
+        # Photos uploaded after this are added by the upload, not by paging
+        until_id = photos_repo(conn).next_id()
+        gallery = _gallery_page(conn, album, limit, until_id=until_id)
 
     return render_template(
         "albums/album.html.j2",
         album=album,
-        photos=photos,
-        user_map=user_map,
-        limit=limit,
+        image_files=image_files_for(p.photo_path for p in gallery["photos"]),
+        **gallery,
     )
 
 
+@blueprint.route("/<int:id>/gallery/")
+@conditional_get("albums", "photos", "users", "image_files")
+def album_gallery(id: int):
+    """
+    The next page of the gallery, loaded as it's scrolled to.
+    """
+    with db_conn() as conn:
+        album = albums_repo(conn).get_or_404(id=id)
+        gallery = _gallery_page(
+            conn,
+            album,
+            limit=min(request.args.get("limit", type=int, default=20), MAX_PAGE_SIZE),
+            after_id=request.args.get("after", type=int),
+            until_id=request.args.get("until", type=int),
+            num_shown=request.args.get("shown", type=int, default=0),
+        )
+
+    return render_template(
+        "albums/album._gallery.html.j2",
+        album=album,
+        image_files=image_files_for(p.photo_path for p in gallery["photos"]),
+        **gallery,
+    )
+
+
+def _add_uploads(
+    conn: Connection, album: Album, uploaded: list[UploadResult], errors: list[str]
+) -> list[Photo]:
+    """
+    Adds the uploads to the album, apart from any already in it. Those, and any
+    that look like photos already in it, get a message in `errors`.
+    """
+    photos_db = photos_repo(conn)
+    album_photos = photos_db.list_where(album_id=album.id)
+    next_id = photos_db.next_id() or 1
+
+    new_photos = []
+    for result in uploaded:
+        assert result.photo_path is not None
+        if (perceptual_hash := result.perceptual_hash) is None:
+            # Uploaded before, so wasn't processed again
+            earlier = photos_db.select(
+                "photo_path = :photo_path",
+                {"photo_path": str(result.photo_path)},
+                limit=1,
+            )
+            perceptual_hash = earlier[0].perceptual_hash if earlier else None
+
+        photo = Photo(
+            id=next_id,
+            uploader_id=g.current_user.id,
+            album_id=album.id,
+            starred=False,
+            photo_path=result.photo_path,
+            perceptual_hash=perceptual_hash,
+        )
+        if (duplicate := find_duplicate(photo, album_photos)) is not None:
+            if duplicate.photo_path == photo.photo_path:
+                errors.append(f"{result.filename} is already in this album")
+                continue
+            errors.append(f"{result.filename} looks like a photo already in this album")
+
+        photos_db.insert(photo)
+        new_photos.append(photo)
+        album_photos.append(photo)
+        next_id += 1
+    return new_photos
+
+
+def _gallery_page(
+    conn: Connection,
+    album: Album,
+    limit: int,
+    after_id: int | None = None,
+    until_id: int | None = None,
+    num_shown: int = 0,
+) -> dict:
+    limit = max(limit, 1)
+    # One extra, to know whether there's another page
+    photos = album_photos_page(conn, album.id, limit + 1, after_id, until_id)
+    uploaders = {
+        u.id: u for u in users_repo(conn).get_all(id={p.uploader_id for p in photos})
+    }
+    return {
+        "photos": photos[:limit],
+        "uploaders": uploaders,
+        "has_more": len(photos) > limit,
+        "limit": limit,
+        "until_id": until_id,
+        "num_shown": num_shown + min(len(photos), limit),
+    }
+
+
 @blueprint.route("/<int:album_id>/photos/<int:photo_id>/", methods=["GET", "POST"])
+@conditional_get("albums", "photos", "users", "image_files")
 def album_photo(album_id: int, photo_id: int):
     if request.method == "POST":
         current_user.check_authorised()
@@ -144,23 +254,12 @@ def album_photo(album_id: int, photo_id: int):
     else:
         with db_conn() as conn:
             album = albums_repo(conn).get_or_404(id=album_id)
-            photos = _get_sorted_photos(conn, album)
-
-            try:
-                photo_ix = [p.id for p in photos].index(photo_id)
-            except ValueError:
+            photo = photos_repo(conn).get(id=photo_id)
+            if photo is None or photo.album_id != album.id:
                 abort(404, "Photo not found.")
 
-            photo = photos[photo_ix]
             uploader = users_repo(conn).get(id=photo.uploader_id)
-
-            prev_photo = None
-            if photo_ix != 0:
-                prev_photo = photos[photo_ix - 1]
-
-            next_photo = None
-            if (photo_ix + 1) != len(photos):
-                next_photo = photos[photo_ix + 1]
+            prev_photo, next_photo = adjacent_photos(conn, photo)
 
         if request.headers.get("HX-Target") == "highlighted-photo":
             return render_template(
@@ -180,10 +279,3 @@ def album_photo(album_id: int, photo_id: int):
                 photo=photo,
                 next_photo=next_photo,
             )
-
-
-def _get_sorted_photos(conn: Connection, album: Album) -> list[Photo]:
-    return sorted(
-        photos_repo(conn).list_where(album_id=album.id),
-        key=lambda p: p.created_at_utc,
-    )
@@ -1,25 +1,30 @@
 import datetime
 import logging
 import textwrap
+from pathlib import Path
 
-import mistune
 from flask import Flask, Response, current_app, g, render_template, request, session
 from flask.logging import default_handler
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from mountains.context import db_conn, send_mail
+from mountains.context import db_conn, get_session_user, send_mail
+from mountains.derivatives import start_derivative_worker
 from mountains.discord import DiscordAPI
+from mountains.markdown import MarkdownRenderer
+from mountains.passwords import PasswordHasher
 from mountains.payments import (
     EventPaymentMetadata,
     MembershipPaymentMetadata,
     StripeAPI,
 )
+from mountains.sweeper import start_token_sweeper
+from mountains.uploads import PhotoProcessor
 
 from . import auth, platform, ics
 from .models.events import attendees_repo, events_repo
+from .models.image_files import image_files_for
 from .models.pages import latest_content
 from .models.photos import photos_repo
-from .models.tokens import tokens_repo
 from .models.users import users_repo
 
 
@@ -54,16 +59,48 @@ def create_app():
         CMC_MEMBERSHIP_EXPIRY=datetime.date(2027, 3, 31),
         CMC_MAX_TRIAL_EVENTS=4,
     )
+    # How far back personal calendar feeds go (FLASK_CMC_ICS_HISTORY_DAYS)
+    app.config.setdefault("CMC_ICS_HISTORY_DAYS", 365)
+    # Logins allowed at once per user, oldest are logged out first
+    app.config.setdefault("CMC_MAX_SESSIONS", 10)
+    # How often to clear out expired tokens, 0 to never
+    app.config.setdefault("CMC_TOKEN_SWEEP_SECS", 3600)
+    # Keep who is logged in in the signed session cookie, rather than a token
+    app.config.setdefault("CMC_STATELESS_SESSIONS", False)
+    # Method and cost for new password hashes, older ones are rehashed on login
+    app.config.setdefault("CMC_PASSWORD_METHOD", "scrypt")
+    # Passwords hashed at once per worker, and how many more can wait their turn
+    app.config.setdefault("CMC_PASSWORD_WORKERS", 2)
+    app.config.setdefault("CMC_PASSWORD_QUEUED", 8)
+    # Processes per worker for resizing uploaded photos, 0 to share the cores out
+    # between the CMC_WEB_WORKERS gunicorn workers (keep in step with prod.sh)
+    app.config.setdefault("CMC_PHOTO_PROCESSES", 0)
+    app.config.setdefault("CMC_WEB_WORKERS", 4)
+    # How often to check for thumbnails to make, 0 to leave it to another process
+    app.config.setdefault("CMC_DERIVATIVE_POLL_SECS", 10)
+
+    app.extensions["password_hasher"] = PasswordHasher.from_config(app.config)
+    app.extensions["photo_processor"] = PhotoProcessor.from_config(app.config)
+
+    if app.config["CMC_TOKEN_SWEEP_SECS"]:
+        start_token_sweeper(app.config["DB_NAME"], app.config["CMC_TOKEN_SWEEP_SECS"])
+
+    if app.config["CMC_DERIVATIVE_POLL_SECS"]:
+        start_derivative_worker(
+            app.config["DB_NAME"],
+            Path(app.config["STATIC_FOLDER"]),
+            app.config["CMC_DERIVATIVE_POLL_SECS"],
+        )
 
     app.register_blueprint(platform.blueprint)
     app.register_blueprint(auth.blueprint)
     app.register_blueprint(ics.blueprint)
 
+    markdown = MarkdownRenderer.from_app(app)
+
     @app.template_filter("markdown")
     def convert_markdown(s: str) -> str:
-        html: str = mistune.html(s)  # type: ignore
-
-        return html
+        return markdown.render(s)
 
     @app.context_processor
     def now_dt() -> dict:
@@ -86,6 +123,7 @@ def create_app():
             page=page,
             upcoming_events=upcoming_events,
             recent_photos=recent_photos,
+            image_files=image_files_for(p.photo_path for p in recent_photos),
         )
 
     @app.route("/faqs/")
@@ -235,13 +273,7 @@ def create_app():
     def current_user():
         session.permanent = True
         # Ensure all requests have access to the current user, if logged in
-        if (token_id := session.get("token_id")) is not None:
-            with db_conn() as conn:
-                token = tokens_repo(conn).get(id=token_id)
-                if (
-                    token is not None
-                    and (user := users_repo(conn).get(id=token.user_id)) is not None
-                ):
-                    g.current_user = user
+        if (user := get_session_user()) is not None:
+            g.current_user = user
 
     return app
@@ -2,6 +2,7 @@ import logging
 import uuid
 from typing import Mapping
 
+from cattrs import unstructure
 from flask import (
     Blueprint,
     current_app,
@@ -11,12 +12,25 @@ from flask import (
     session,
     url_for,
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from mountains.context import db_conn, send_mail
+from mountains.context import (
+    db_conn,
+    end_session,
+    forget_claimed_user,
+    get_session_user,
+    password_hasher,
+    send_mail,
+)
 from mountains.errors import MountainException
-from mountains.models.tokens import AuthToken, tokens_repo
+from mountains.models.tokens import (
+    AuthToken,
+    SessionClaim,
+    prune_user_tokens,
+    revoke_session_claims,
+    tokens_repo,
+)
 from mountains.models.users import User, users_repo
+from mountains.passwords import AttemptLimiter
 from mountains.utils import now_utc
 
 logger = logging.getLogger(__name__)
@@ -25,6 +39,14 @@ __all__ = ["blueprint"]
 
 blueprint = Blueprint("auth", __name__, url_prefix="/auth", template_folder="templates")
 
+# Checking a password is slow, so stop anyone guessing at them for a while
+_email_failures = AttemptLimiter(
+    name="login-failures-email", max_attempts=10, window_secs=15 * 60
+)
+_ip_failures = AttemptLimiter(
+    name="login-failures-ip", max_attempts=50, window_secs=15 * 60
+)
+
 
 @blueprint.route("/login/", methods=["GET", "POST"])
 def login():
@@ -36,11 +58,32 @@ def login():
             token_db = tokens_repo(conn)
 
             email = form["email"].lower()
+            ip = request.remote_addr or ""
+            if _email_failures.is_blocked(email) or _ip_failures.is_blocked(ip):
+                logger.warning("Too many failed logins for email %s from %s", email, ip)
+                return redirect(
+                    url_for(
+                        "auth.login",
+                        redirect=redirect_path,
+                        error="Too many failed logins - please try again later.",
+                    )
+                )
+
+            hasher = password_hasher()
             user = user_db.get(email=email)
-            if user is None or not check_password_hash(
-                user.password_hash, form["password"]
-            ):
+            try:
+                is_valid = user is not None and hasher.check(
+                    user.password_hash, form["password"]
+                )
+            except MountainException as e:
+                return redirect(
+                    url_for("auth.login", redirect=redirect_path, error=str(e))
+                )
+
+            if user is None or not is_valid:
                 logger.warning("Failed login attempt for email %s", email)
+                _email_failures.record_failure(email)
+                _ip_failures.record_failure(ip)
                 return redirect(
                     url_for(
                         "auth.login",
@@ -53,16 +96,31 @@ def login():
                 logger.info("Logging in %s", user)
                 user_db.update(id=user.id, last_login_utc=now_utc())
 
-                logger.debug("Expiring any old tokens for %s...", user)
-                for token in token_db.list_where(id=user.id):
-                    if not token.is_valid():
-                        logger.info("Removing old token %r", token)
-                        token_db.delete_where(id=token.id)
+                if hasher.needs_rehash(user.password_hash):
+                    try:
+                        user_db.update(
+                            id=user.id, password_hash=hasher.hash(form["password"])
+                        )
+                        logger.info("Rehashed password for %s", user)
+                    except MountainException:
+                        # Too busy - it can wait until next time
+                        pass
 
-                logger.debug("Generating new token for %s...", user)
-                token = AuthToken.from_id(id=user.id, valid_days=30)
-                token_db.insert(token)
-                session["token_id"] = token.id
+                if current_app.config["CMC_STATELESS_SESSIONS"]:
+                    session["claim"] = unstructure(SessionClaim.for_user(user))
+                else:
+                    logger.debug("Generating new token for %s...", user)
+                    token = AuthToken.from_id(id=user.id, valid_days=30)
+                    token_db.insert(token)
+
+                    # Clear their expired tokens, and log out their oldest sessions
+                    num_removed = prune_user_tokens(
+                        conn, user.id, keep=current_app.config["CMC_MAX_SESSIONS"]
+                    )
+                    if num_removed > 0:
+                        logger.info("Removed %s old tokens for %s", num_removed, user)
+
+                    session["token_id"] = token.id
                 if redirect_path:
                     return redirect(request.root_path + redirect_path)
                 return redirect(url_for("platform.home"))
@@ -83,8 +141,10 @@ def forgot_password():
             if (user := user_db.get(email=email)) is not None:
                 logger.info("Resetting password for %s", user)
                 token_db = tokens_repo(conn)
-                # Delete all old tokens
+                # Delete all old tokens, and log them out everywhere
                 token_db.delete_where(user_id=user.id)
+                revoke_session_claims(conn, user.id)
+                forget_claimed_user(user.id)
 
                 # Reset the password to some nonsense
                 user_db.update(id=user.id, password_hash=str(uuid.uuid4()))
@@ -129,7 +189,10 @@ def reset_password():
                     error="Entered passwords do not match.",
                 )
             else:
-                password_hash = generate_password_hash(form["password"])
+                try:
+                    password_hash = password_hasher().hash(form["password"])
+                except MountainException as e:
+                    return render_template("auth/resetpassword.html.j2", error=str(e))
                 user_db.update(id=user.id, password_hash=password_hash)
 
                 return redirect(
@@ -154,7 +217,15 @@ def register():
 
 @blueprint.route("/logout/", methods=["POST"])
 def logout():
-    del session["token_id"]
+    if (user := get_session_user()) is not None:
+        with db_conn() as conn:
+            if (token_id := session.get("token_id")) is not None:
+                tokens_repo(conn).delete_where(id=token_id)
+            if "claim" in session:
+                # Claims can't be revoked one at a time, so this is everywhere
+                revoke_session_claims(conn, user.id)
+                forget_claimed_user(user.id)
+    end_session()
     return redirect(url_for("index"))
 
 
@@ -166,7 +237,7 @@ def _register_new_user(db_name: str, form: Mapping[str, str]):
     if form["bot_question"].lower().strip() not in ('ben nevis', 'nevis', 'the ben'):
         raise MountainException("Incorrect answer to security question!")
 
-    password_hash = generate_password_hash(form["password"])
+    password_hash = password_hasher().hash(form["password"])
 
     # Lock the DB so we can generate a new user ID and insert
     with db_conn(locked=True) as conn:
@@ -0,0 +1,245 @@
+"""
+Small in-process caches.
+
+Each gunicorn worker has its own copy of these, so anything cached here should
+either be keyed on something read from the DB (e.g. `updated_on_utc` or a
+generation counter), or be fine to be stale for its TTL.
+
+`SQLiteCache` is shared between workers instead, so is only for values keyed on
+their content (e.g. a hash), which can never go stale.
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from attrs import define, field
+
+from mountains.db import connection
+from mountains.utils import now_utc
+
+logger = logging.getLogger(__name__)
+
+# All caches created, so we can report on them
+_caches: list[LRUCache | SQLiteCache] = []
+
+
+@define
+class CacheStats:
+    name: str
+    hits: int
+    misses: int
+    entries: int
+    size: int
+    max_size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+@define
+class LRUCache[K: Hashable, V]:
+    """
+    A thread-safe least-recently-used cache, bounded by total size.
+
+    By default each entry has size 1, so `max_size` is a number of entries. Pass
+    `size_of` to bound by something else, like the length of cached text.
+    """
+
+    name: str
+    max_size: int
+    size_of: Callable[[V], int] = lambda _: 1
+    ttl_secs: float | None = None
+    # key -> (value, size, expiry)
+    _entries: OrderedDict[K, tuple[V, int, float | None]] = field(
+        init=False, factory=OrderedDict
+    )
+    _size: int = field(init=False, default=0)
+    _hits: int = field(init=False, default=0)
+    _misses: int = field(init=False, default=0)
+    _lock: threading.Lock = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        _caches.append(self)
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry[2] is not None
+                and entry[2] < time.monotonic()
+            ):
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+            else:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+
+    def set(self, key: K, value: V) -> None:
+        size = self.size_of(value)
+        if size > self.max_size:
+            # Would just evict everything else
+            return
+
+        if self.ttl_secs is not None:
+            expiry = time.monotonic() + self.ttl_secs
+        else:
+            expiry = None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expiry)
+            self._size += size
+
+            while self._size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_set(self, key: K, make: Callable[[], V]) -> V:
+        """
+        Gets the cached value, or calls `make` to create and cache it.
+
+        `make` is called outside the lock, so may run more than once at a time for
+        the same key.
+        """
+        value = self.get(key)
+        if value is None:
+            value = make()
+            self.set(key, value)
+        return value
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def discard_where(self, predicate: Callable[[K], bool]) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                name=self.name,
+                hits=self._hits,
+                misses=self._misses,
+                entries=len(self._entries),
+                size=self._size,
+                max_size=self.max_size,
+            )
+
+    def _remove(self, key: K) -> None:
+        # Should only be called with the lock held
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+
+@define
+class SQLiteCache:
+    """
+    A text cache in its own SQLite file, so it is shared between workers and
+    survives them restarting.
+
+    Holds roughly `max_entries`, dropping the oldest first. Errors (e.g. the file
+    being locked) are logged and treated as misses, as this is only ever a cache.
+    """
+
+    name: str
+    path: str
+    max_entries: int
+    _hits: int = field(init=False, default=0)
+    _misses: int = field(init=False, default=0)
+    _lock: threading.Lock = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        with connection(self.path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_utc DATETIME NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_created_utc ON cache(created_utc)"
+            )
+        _caches.append(self)
+
+    def get(self, key: str) -> str | None:
+        try:
+            with connection(self.path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            logger.warning("Failed reading from cache %s", self.name, exc_info=True)
+            row = None
+
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            else:
+                self._hits += 1
+                return row["value"]
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            with connection(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, created_utc)"
+                    " VALUES (?, ?, ?)",
+                    (key, value, now_utc().isoformat()),
+                )
+                conn.execute(
+                    """
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache
+                        ORDER BY created_utc DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+        except sqlite3.Error:
+            logger.warning("Failed writing to cache %s", self.name, exc_info=True)
+
+    def stats(self) -> CacheStats:
+        try:
+            with connection(self.path) as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = 0
+
+        with self._lock:
+            return CacheStats(
+                name=self.name,
+                hits=self._hits,
+                misses=self._misses,
+                entries=entries,
+                size=entries,
+                max_size=self.max_entries,
+            )
+
+
+def cache_stats() -> list[CacheStats]:
+    return [c.stats() for c in _caches]
@@ -16,12 +16,18 @@ from flask import (
 )
 from requests.exceptions import ConnectionError
 
+from mountains.cache import cache_stats
 from mountains.context import current_user, db_conn
 from mountains.discord import DiscordAPI
 from mountains.events import EventType
 from mountains.models.activity import activity_repo
-from mountains.models.events import attendees_repo, events_repo
-from mountains.models.pages import Page, latest_page, pages_repo
+from mountains.models.events import (
+    attendees_repo,
+    event_counts_repo,
+    events_repo,
+    trial_tallies,
+)
+from mountains.models.pages import Page, latest_page, latest_pages, pages_repo
 from mountains.models.stripetransaction import stripe_transactions_repo
 from mountains.models.users import users_repo
 from mountains.payments import StripeAPI
@@ -57,15 +63,31 @@ def overview():
             activity_repo(conn).list(), key=lambda a: a.dt, reverse=True
         )
 
+        # Get trial users who have used up their trial
+        tallies = trial_tallies(
+            conn,
+            [
+                u.id
+                for u in user_map.values()
+                if not u.is_dormant and u.membership_expiry is None
+            ],
+        )
+
     # Get member counts
     member_stats = defaultdict(int)
     for u in user_map.values():
         if not u.is_dormant:
             member_stats[u.membership_expiry] += 1
 
+    num_trial_over = sum(
+        t.num_trial_events > current_app.config["CMC_MAX_TRIAL_EVENTS"]
+        for t in tallies.values()
+    )
+
     return render_template(
         "committee/overview.html.j2",
         member_stats=member_stats,
+        num_trial_over=num_trial_over,
         activities=activities,
         num_activities=num_activities,
         user_map=user_map,
@@ -140,6 +162,7 @@ def maintenance():
         member_mismatches=member_mismatches,
         user_map=user_map,
         event_map=event_map,
+        cache_stats=cache_stats(),
     )
 
 
@@ -225,11 +248,17 @@ def treasurer():
             user_map = {u.id: u for u in users_repo(conn).list()}
             event_map = {e.id: e for e in events_repo(conn).list()}
 
-            # Get unpaid users
-            attendees = attendees_repo(conn).list_where(
-                is_trip_paid=False, is_waiting_list=False
-            )
-            unpaid_attendees = [a for a in attendees if event_map[a.event_id].price_id]
+            # Get unpaid users, only looking at paid events where someone hasn't
+            unpaid_event_ids = [
+                c.event_id
+                for c in event_counts_repo(conn).select("num_paid < num_attending")
+                if c.event_id in event_map and event_map[c.event_id].price_id
+            ]
+            unpaid_attendees = [
+                a
+                for a in attendees_repo(conn).get_all(event_id=unpaid_event_ids)
+                if not a.is_trip_paid and not a.is_waiting_list
+            ]
 
             stripe_trans = sorted(
                 stripe_transactions_repo(conn).list(),
@@ -336,7 +365,7 @@ def page_editor():
             with db_conn() as conn:
                 pages_db = pages_repo(conn)
                 if "new" in request.form:
-                    page = Page(
+                    page = Page.publish(
                         name=request.form["name"],
                         description=request.form["description"],
                         markdown=request.form["markdown"],
@@ -351,7 +380,7 @@ def page_editor():
                         )
                 elif "edit" in request.form:
                     latest = latest_page(request.form["name"], repo=pages_db)
-                    page = Page(
+                    page = Page.publish(
                         name=request.form["name"],
                         description=request.form["description"],
                         markdown=request.form["markdown"],
@@ -382,12 +411,7 @@ def page_editor():
                 return redirect(url_for(".page_editor"))
 
     with db_conn() as conn:
-        all_pages = pages_repo(conn).list()
-        page_names = set(p.name for p in all_pages)
-        pages = sorted(
-            [latest_page(name, pages_repo(conn)) for name in page_names],
-            key=lambda p: p.description,
-        )
+        pages = sorted(latest_pages(conn).values(), key=lambda p: p.description)
 
     all_files = [Path("content") / f.name for f in CONTENT_PATH.glob("*")]
     image_paths = [
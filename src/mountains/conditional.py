@@ -0,0 +1,109 @@
+"""
+Conditional GET support, so refreshing an unchanged page is a 304 rather than a
+full render.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from flask import Response, make_response, request
+
+from mountains.context import current_user, db_conn, table_generations
+from mountains.utils import now_utc
+
+if TYPE_CHECKING:
+    from typing import Callable
+
+# When rows of these tables were last edited, which also goes into their ETags
+_UPDATED_COLUMNS = {"events": "updated_on_utc"}
+
+
+def conditional_get(*tables: str):
+    """
+    Adds an ETag to GET responses, and answers a matching If-None-Match with a 304
+    before calling the view at all.
+
+    The ETag covers the generations of `tables` (and when they were last edited,
+    where that's recorded), so the view must only depend on those tables, the
+    current user and the time (to the minute).
+    """
+
+    def decorator(view: Callable) -> Callable:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+
+            all_generations = table_generations()
+            generations = [all_generations[t] for t in tables if t in all_generations]
+            last_edited = _last_edited(tables)
+
+            etag = _etag(
+                *sorted((g.name, g.generation) for g in generations),
+                last_edited,
+                # Pages differ per user (e.g. attend buttons), as well as by role
+                current_user.id,
+                current_user.role_class,
+                # Covers time-based changes like signups opening
+                now_utc().strftime("%Y-%m-%dT%H:%M"),
+                request.headers.get("HX-Request"),
+                request.headers.get("HX-Target"),
+            )
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if generations:
+                response.last_modified = max(g.updated_utc for g in generations)
+            # Always check back with us, and never share with other users
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.update(("Cookie", "HX-Request", "HX-Target"))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _last_edited(tables: tuple[str, ...]) -> list[tuple[str, str]]:
+    columns = [(t, c) for t, c in _UPDATED_COLUMNS.items() if t in tables]
+    if not columns:
+        return []
+    with db_conn() as conn:
+        return [
+            (table, conn.execute(f"SELECT MAX({column}) FROM {table}").fetchone()[0])
+            for table, column in columns
+        ]
+
+
+def _etag(*parts) -> str:
+    return hashlib.sha1(repr((_code_version(), *parts)).encode()).hexdigest()
+
+
+@functools.cache
+def _code_version() -> float:
+    """
+    Changes whenever we deploy new code or templates, so pages rendered by the old
+    version aren't reused.
+    """
+    mtimes = []
+    for dir_path, dir_names, file_names in os.walk(Path(__file__).parent):
+        # Static folders hold uploads, far too many to stat
+        dir_names[:] = [d for d in dir_names if d not in ("static", "__pycache__")]
+        mtimes.extend(
+            os.stat(os.path.join(dir_path, name)).st_mtime
+            for name in file_names
+            if name.endswith((".py", ".j2"))
+        )
+    return max(mtimes)
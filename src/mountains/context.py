@@ -3,17 +3,25 @@ from __future__ import annotations
 from contextlib import contextmanager
 from typing import TYPE_CHECKING
 
-from flask import current_app, g
+from cattrs import BaseValidationError, structure
+from flask import current_app, g, session
 from werkzeug.local import LocalProxy
 
+from mountains.cache import LRUCache
 from mountains.db import connection
 from mountains.email import send_mail_api
+from mountains.models.generations import table_generations_repo
+from mountains.models.tokens import SessionClaim, tokens_repo
+from mountains.models.users import users_repo
 
 if TYPE_CHECKING:
     from sqlite3 import Connection
     from typing import Generator
 
+    from mountains.models.generations import TableGeneration
     from mountains.models.users import User
+    from mountains.passwords import PasswordHasher
+    from mountains.uploads import PhotoProcessor
 
 
 @contextmanager
@@ -25,6 +33,112 @@ def db_conn(locked: bool = False) -> Generator[Connection, None, None]:
         yield conn
 
 
+def table_generations() -> dict[str, TableGeneration]:
+    """
+    Every table's generation (see migrations/0011), looked up once per request and
+    shared by everything keyed on them.
+    """
+    if "table_generations" not in g:
+        with db_conn() as conn:
+            g.table_generations = {
+                t.name: t for t in table_generations_repo(conn).list()
+            }
+    return g.table_generations
+
+
+# (token id, tokens generation, users generation) -> (user, token)
+_session_users = LRUCache(name="session-users", max_size=1000)
+
+
+def get_session_user() -> User | None:
+    """
+    The user logged in with this request's session token, if any.
+
+    This is only looked up once per request. Across requests it's cached until a
+    token is removed or a user's details change, so logging out or changing
+    someone's flags (e.g. dormant or committee) applies straight away in every
+    worker. Logging in doesn't change either (see migrations/0023 and 0024), so
+    doesn't empty the cache.
+    """
+    if "session_user" not in g:
+        if current_app.config["CMC_STATELESS_SESSIONS"]:
+            g.session_user = _claimed_session_user(session.get("claim"))
+        else:
+            g.session_user = _lookup_session_user(session.get("token_id"))
+    return g.session_user
+
+
+def is_logged_in() -> bool:
+    """
+    Whether the session says someone is logged in, without checking it's valid.
+    """
+    return "token_id" in session or "claim" in session
+
+
+def end_session() -> None:
+    session.pop("token_id", None)
+    session.pop("claim", None)
+
+
+def _lookup_session_user(token_id: str | None) -> User | None:
+    if token_id is None:
+        return None
+
+    generations = table_generations()
+    tokens, users = generations.get("tokens"), generations.get("users")
+    key = (token_id, tokens and tokens.generation, users and users.generation)
+    cached = _session_users.get(key)
+
+    if cached is None:
+        with db_conn() as conn:
+            token = tokens_repo(conn).get(id=token_id)
+            if token is None:
+                return None
+            user = users_repo(conn).get(id=token.user_id)
+            if user is None:
+                return None
+
+        cached = (user, token)
+        # Without both generations we'd never know when this went stale
+        if tokens is not None and users is not None:
+            _session_users.set(key, cached)
+
+    user, token = cached
+    return user if token.is_valid() else None
+
+
+# user id -> user, for stateless sessions. Changes to users (including revoking
+# their sessions) take up to this TTL to reach every worker.
+_claim_users = LRUCache(name="session-claim-users", max_size=1000, ttl_secs=30)
+
+
+def _claimed_session_user(claim_data: dict | None) -> User | None:
+    if claim_data is None:
+        return None
+
+    try:
+        claim = structure(claim_data, SessionClaim)
+    except (BaseValidationError, ValueError):
+        return None
+
+    user = _claim_users.get(claim.user_id)
+    if user is None:
+        with db_conn() as conn:
+            user = users_repo(conn).get(id=claim.user_id)
+        if user is None:
+            return None
+        _claim_users.set(claim.user_id, user)
+
+    return user if claim.is_valid_for(user) else None
+
+
+def forget_claimed_user(user_id: int) -> None:
+    """
+    Drops a user from this worker's stateless session cache, e.g. after revoking.
+    """
+    _claim_users.discard(user_id)
+
+
 def get_current_user() -> User:
     return g.current_user
 
@@ -43,3 +157,17 @@ def send_mail(*, to: list[str], subject: str, msg_markdown: str) -> None:
         debug=current_app.debug,
         api_key=current_app.config["MAILGUN_API_KEY"],
     )
+
+
+def password_hasher() -> PasswordHasher:
+    """
+    The app's shared password hasher (see `mountains.passwords`).
+    """
+    return current_app.extensions["password_hasher"]
+
+
+def photo_processor() -> PhotoProcessor:
+    """
+    The app's shared pool for processing photo uploads (see `mountains.uploads`).
+    """
+    return current_app.extensions["photo_processor"]
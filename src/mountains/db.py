@@ -66,6 +66,7 @@ class Repository[T]:
     schema: list[str]
     storage_cls: type[T]
     id_col: str = "id"
+    indexes: list[str] = attrs.Factory(list)
 
     @property
     def _field_names(self) -> list[str]:
@@ -87,6 +88,8 @@ class Repository[T]:
             CREATE TABLE IF NOT EXISTS {self.table_name} 
             ({",".join(self.schema)})
         """)
+        for index in self.indexes:
+            self._try_execute(index)
 
     def drop_table(self):
         self._try_execute(f"DROP TABLE IF EXISTS {self.table_name}")
@@ -191,6 +194,33 @@ class Repository[T]:
         rows = cur.fetchall()
         return [structure(dict(row), self.storage_cls) for row in rows]
 
+    def select(
+        self,
+        where: str,
+        params: dict | None = None,
+        *,
+        order_by: str | None = None,
+        limit: int | None = None,
+    ) -> typing.List[T]:
+        """
+        For queries `list_where` can't express (ranges, ORs, ordering).
+
+        `where` is raw SQL, so always pass values through `params`.
+        """
+        query = f"""
+            SELECT {",".join(self._field_names)}
+            FROM {self.table_name}
+            WHERE {where}
+        """
+        if order_by is not None:
+            query += f" ORDER BY {order_by}"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+
+        cur = self._try_execute(query, params if params is not None else {})
+        rows = cur.fetchall()
+        return [structure(dict(row), self.storage_cls) for row in rows]
+
     def delete_where(self, **kwargs):
         self._try_execute(
             f"""
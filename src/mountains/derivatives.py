@@ -0,0 +1,86 @@
+"""
+Makes resized copies (thumbnails, WebP and so on) of uploaded photos in the
+background, from the queue in the derivative_jobs table.
+
+The queue is in the DB so it survives restarts, and is shared by every gunicorn
+worker. Each runs its own worker thread, and jobs are claimed before they're made
+so no two threads make the same one.
+"""
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from mountains.db import connection
+from mountains.models.derivatives import (
+    claim_derivative_job,
+    derivative_jobs_repo,
+    release_derivative_job,
+)
+from mountains.models.image_files import record_image_files
+from mountains.models.photos import make_derivative
+
+logger = logging.getLogger(__name__)
+
+# How long a worker has to make a job's copies before others may try it too
+CLAIM_SECS = 300
+# Give up on a job after this many tries (e.g. the photo is corrupt)
+MAX_ATTEMPTS = 3
+
+
+def start_derivative_worker(
+    db_name: str, static_dir: Path, poll_secs: float
+) -> threading.Thread:
+    thread = threading.Thread(
+        target=_work_forever,
+        args=(db_name, static_dir, poll_secs),
+        name="derivative-worker",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def make_derivatives(db_name: str, static_dir: Path) -> int:
+    """
+    Works through the queue until it's empty. Returns how many jobs were done.
+    """
+    num_made = 0
+    while True:
+        with connection(db_name) as conn:
+            job = claim_derivative_job(conn, CLAIM_SECS, MAX_ATTEMPTS)
+        if job is None:
+            return num_made
+
+        try:
+            image_files = make_derivative(static_dir, job.source_path, job.width)
+        except Exception:
+            logger.exception(
+                "Failed making %spx copies of %s (attempt %s of %s)",
+                job.width,
+                job.source_path,
+                job.attempts,
+                MAX_ATTEMPTS,
+            )
+            with connection(db_name) as conn:
+                release_derivative_job(conn, job)
+        else:
+            with connection(db_name, locked=True) as conn:
+                record_image_files(conn, image_files)
+                derivative_jobs_repo(conn).delete_where(id=job.id)
+            num_made += 1
+
+
+def _work_forever(db_name: str, static_dir: Path, poll_secs: float) -> None:
+    while True:
+        try:
+            num_made = make_derivatives(db_name, static_dir)
+            if num_made > 0:
+                logger.info("Made copies of %s photos", num_made)
+        except sqlite3.Error:
+            logger.exception("Failed reading the derivative queue")
+
+        time.sleep(random.uniform(0.5, 1.5) * poll_secs)
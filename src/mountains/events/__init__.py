@@ -15,18 +15,24 @@ from flask import (
     url_for,
 )
 
+from mountains.conditional import conditional_get
 from mountains.context import current_user, db_conn
 from mountains.discord import DiscordAPI
 from mountains.errors import MountainException
+from mountains.events import fragments
 from mountains.models.activity import Activity, activity_repo
 from mountains.models.events import (
     Attendee,
     Event,
     EventType,
     attendees_repo,
+    event_counts,
+    events_overlapping,
     events_repo,
+    past_trial_events,
+    trial_tallies,
 )
-from mountains.models.pages import latest_content, latest_page, pages_repo
+from mountains.models.pages import latest_contents, latest_page, pages_repo
 from mountains.models.tokens import ICSToken, tokens_ics_repo
 from mountains.models.users import User, users_repo
 from mountains.payments import EventPaymentMetadata, StripeAPI
@@ -37,10 +43,22 @@ logger = logging.getLogger(__name__)
 blueprint = Blueprint("events", __name__, template_folder="templates")
 
 
+@blueprint.context_processor
+def cached_fragments() -> dict:
+    return {
+        "event_body": fragments.event_body,
+        "event_attendee_lists": fragments.event_attendee_lists,
+    }
+
+
 @blueprint.route("/upcoming/")
 @blueprint.route("/")
 @blueprint.route("/<int:event_id>/")
+@conditional_get("events", "attendees", "users", "image_files")
 def events(event_id: int | None = None):
+    if event_id is not None:
+        return _single_event(event_id)
+
     search = request.args.get("search")
     limit = request.args.get("limit", type=int, default=5)
 
@@ -54,11 +72,6 @@ def events(event_id: int | None = None):
         event_types = [t for t in EventType]
 
     with db_conn() as conn:
-        if event_id is not None:
-            event = events_repo(conn).get_or_404(id=event_id)
-        else:
-            event = None
-
         # TODO: Eventually page this (e.g. at least <x> more )
         events = _get_sorted_filtered_events(
             conn,
@@ -66,60 +79,66 @@ def events(event_id: int | None = None):
             search=search,
         )
 
-        if event is not None:
-            events_for_metadata = events + [event]
+        if request.headers.get("HX-Target") == "show-more-events":
+            after_ix = [e.id for e in events].index(int(request.args["after"])) + 1
+            shown_events = events[after_ix : after_ix + limit]
         else:
-            events_for_metadata = events
+            shown_events = events[:limit]
 
-        event_attendees, event_members = _events_attendees(conn, events_for_metadata)
+        event_attendees, event_members = _events_attendees(conn, shown_events)
+        counts = event_counts(conn, [e.id for e in shown_events])
 
-    if event is not None:
-        # Single event display
-        if request.headers.get("HX-Target") == event.slug:
-            return render_template(
-                "events/_event.html.j2",
-                event=event,
-                events=events,
-                attendees=event_attendees[event.id],
-                members=event_members,
-            )
-        else:
-            return render_template(
-                "events/event.html.j2",
-                event=event,
-                events=events,
-                attendees=event_attendees[event.id],
-                members=event_members,
-            )
+    if request.headers.get("HX-Target") == "show-more-events":
+        # Infinite scroll
+        return render_template(
+            "events/_event.list.html.j2",
+            events=events,
+            event_type_set=EventType,
+            event_attendees=event_attendees,
+            event_counts=counts,
+            members=event_members,
+            search=search,
+            offset=after_ix,
+            limit=limit,
+            event_types=event_types,
+            filters_enabled=filters_enabled,
+        )
     else:
-        if request.headers.get("HX-Target") == "show-more-events":
-            # Infinite scroll
-            after_id = int(request.args["after"])
-            after_ix = [e.id for e in events].index(after_id)
-            return render_template(
-                "events/_event.list.html.j2",
-                events=events,
-                event_type_set=EventType,
-                event_attendees=event_attendees,
-                members=event_members,
-                search=search,
-                offset=after_ix + 1,
-                limit=limit,
-                event_types=event_types,
-                filters_enabled=filters_enabled,
-            )
-        else:
-            return render_template(
-                "events/events.html.j2",
-                events=events,
-                event_type_set=EventType,
-                event_attendees=event_attendees,
-                members=event_members,
-                search=search,
-                limit=limit,
-                event_types=event_types,
-                filters_enabled=filters_enabled,
-            )
+        return render_template(
+            "events/events.html.j2",
+            events=events,
+            event_type_set=EventType,
+            event_attendees=event_attendees,
+            event_counts=counts,
+            members=event_members,
+            search=search,
+            limit=limit,
+            event_types=event_types,
+            filters_enabled=filters_enabled,
+        )
+
+
+def _single_event(event_id: int):
+    """
+    Display for a single event, only loading that event and its attendees.
+    """
+    with db_conn() as conn:
+        event = events_repo(conn).get_or_404(id=event_id)
+        event_attendees, event_members = _events_attendees(conn, [event])
+        counts = event_counts(conn, [event.id])
+
+    if request.headers.get("HX-Target") == event.slug:
+        template = "events/_event.html.j2"
+    else:
+        template = "events/event.html.j2"
+
+    return render_template(
+        template,
+        event=event,
+        attendees=event_attendees[event.id],
+        counts=counts[event.id],
+        members=event_members,
+    )
 
 
 @blueprint.route("/<id>/", methods=["POST"])
@@ -139,6 +158,7 @@ def event(id: int):
                     action="deleted event",
                 )
             )
+        fragments.invalidate_event(event.id)
 
     # TODO: Message / noti
     return redirect(url_for(".events"))
@@ -146,6 +166,7 @@ def event(id: int):
 
 @blueprint.route("/calendar/")
 @blueprint.route("/calendar/<int:year>/<int:month>/")
+@conditional_get("events")
 def events_calendar(year: int | None = None, month: int | None = None):
     now = now_utc()
     if year is None:
@@ -167,27 +188,19 @@ def events_calendar(year: int | None = None, month: int | None = None):
     ## Push forward to next sunday
     end += datetime.timedelta(days=6 - end.weekday())
 
-    # Get all events between both days
-    with db_conn() as conn:
-        # TODO: Use WHERE in DB
-        events = [
-            e
-            for e in events_repo(conn).list_where(is_deleted=False)
-            if (
-                (e.event_dt >= start and e.event_dt <= end)
-                or (
-                    e.event_end_dt is not None
-                    and e.event_end_dt >= start
-                    and e.event_end_dt <= end
-                )
-            )
-            and (current_user.is_site_admin or not e.is_draft)
-        ]
-
     days = [
-        start.date() + datetime.timedelta(days=i) for i in range((end - start).days)
+        start.date() + datetime.timedelta(days=i) for i in range((end - start).days + 1)
     ]
 
+    # Get all events overlapping the shown days (up to the end of the last sunday)
+    with db_conn() as conn:
+        events = events_overlapping(
+            conn,
+            start=start,
+            end=end + datetime.timedelta(days=1),
+            include_drafts=current_user.is_site_admin,
+        )
+
     # These just need to be accurate down to year-month
     month_dt = datetime.datetime(year, month, 1)
     prev_month_dt = month_dt - datetime.timedelta(days=1)
@@ -200,7 +213,7 @@ def events_calendar(year: int | None = None, month: int | None = None):
         next_month_dt=next_month_dt,
         days=days,
         today=now,
-        events=events,
+        day_events=_events_by_day(events, days),
     )
 
 
@@ -251,6 +264,7 @@ def edit_event(id: int | None = None):
                 activity_repo(conn).insert(
                     Activity(user_id=current_user.id, event_id=event.id, action=action)
                 )
+            fragments.invalidate_event(event.id)
 
             return redirect(url_for(".event", id=event.id))
         except MountainException as e:
@@ -413,25 +427,16 @@ def attend_event(event_id: int):
         event = events_repo(conn).get_or_404(id=event_id)
         popup_names = event.popups_for(current_user)
 
+        past_events = None
         if request.args.get("trial") != "skip" and not current_user.is_member:
-            attending = attendees_repo(conn).list_where(
-                user_id=current_user.id, is_waiting_list=False
-            )
-            events = [
-                e
-                for e in events_repo(conn).get_all(
-                    id=set(a.event_id for a in attending)
-                )
-            ]
-            past_events = [
-                e for e in events if not e.is_upcoming() and e.is_part_of_trial()
-            ]
-            if len(past_events) > current_app.config["CMC_MAX_TRIAL_EVENTS"]:
+            tally = trial_tallies(conn, [current_user.id])[current_user.id]
+            if tally.num_trial_events > current_app.config["CMC_MAX_TRIAL_EVENTS"]:
                 popup_names = ["trial"]
-        else:
-            past_events = None
+                # Only needed to show them in the popup
+                past_events = past_trial_events(conn, current_user.id)
 
-        popups = {name: latest_content(conn, pages[name]) for name in popup_names}
+        contents = latest_contents(conn, [pages[name] for name in popup_names])
+        popups = {name: contents[pages[name]] for name in popup_names}
 
     if request.headers.get("HX-Target") == event.slug:
         return render_template(
@@ -458,6 +463,7 @@ def attend_event(event_id: int):
 def attendee(event_id: int, user_id: int):
     current_user.check_authorised(user_id)
     method = req_method(request)
+    fragments.invalidate_event(event_id)
 
     # Handle updating ICE and mobile if provided
     if method == "POST":
@@ -634,26 +640,41 @@ def _get_sorted_filtered_events(
     return events
 
 
+def _events_by_day(
+    events: list[Event], days: list[datetime.date]
+) -> dict[datetime.date, list[Event]]:
+    """
+    Buckets each event into every one of `days` it is happening on.
+    """
+    day_events: dict[datetime.date, list[Event]] = {day: [] for day in days}
+    for event in events:
+        first_day = max(event.event_dt.date(), days[0])
+        if event.event_end_dt is not None:
+            last_day = min(event.event_end_dt.date(), days[-1])
+        else:
+            last_day = min(event.event_dt.date(), days[-1])
+
+        for i in range((last_day - first_day).days + 1):
+            day_events[first_day + datetime.timedelta(days=i)].append(event)
+
+    return day_events
+
+
 def _events_attendees(
     conn: Connection, events: list[Event]
 ) -> tuple[dict[int, list[Attendee]], dict[int, User]]:
-    attendees_db = attendees_repo(conn)
-    users_db = users_repo(conn)
-    event_attendees: dict[int, list[Attendee]] = {}
-    event_members: dict[int, User] = {}
-    for event in events:
-        evt_attendees = attendees_db.list_where(event_id=event.id)
-        for att_user in evt_attendees:
-            if att_user.user_id not in event_members:
-                user = users_db.get(id=att_user.user_id)
+    event_attendees: dict[int, list[Attendee]] = {e.id: [] for e in events}
+    for attendee in attendees_repo(conn).get_all(event_id=list(event_attendees)):
+        event_attendees[attendee.event_id].append(attendee)
 
-                if user is not None:
-                    event_members[user.id] = user
-                else:
-                    logger.warning(
-                        "Event %s has unknown user id %s", event, att_user.user_id
-                    )
-        event_attendees[event.id] = evt_attendees
+    user_ids = set(a.user_id for atts in event_attendees.values() for a in atts)
+    event_members = {u.id: u for u in users_repo(conn).get_all(id=user_ids)}
+    for event in events:
+        for attendee in event_attendees[event.id]:
+            if attendee.user_id not in event_members:
+                logger.warning(
+                    "Event %s has unknown user id %s", event, attendee.user_id
+                )
 
     return event_attendees, event_members
 
@@ -662,8 +683,7 @@ def _add_user_to_event(event: Event, user_id: int) -> None | Attendee:
     # Lock here as we need to check the waiting list
     with db_conn(locked=True) as conn:
         attendees_db = attendees_repo(conn)
-        event_attendees = attendees_db.list_where(event_id=event.id)
-        if user_id in [a.user_id for a in event_attendees]:
+        if attendees_db.get(user_id=user_id, event_id=event.id) is not None:
             logger.warning(
                 "Attempt to add already existing user %s to event %s, ignoring...",
                 user_id,
@@ -671,10 +691,11 @@ def _add_user_to_event(event: Event, user_id: int) -> None | Attendee:
             )
             return None
         else:
+            counts = event_counts(conn, [event.id])[event.id]
             attendee = Attendee(
                 user_id=user_id,
                 event_id=event.id,
-                is_waiting_list=event.is_full(event_attendees),
+                is_waiting_list=event.is_full(counts),
             )
 
             attendees_db.insert(attendee)
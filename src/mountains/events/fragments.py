@@ -0,0 +1,91 @@
+"""
+Caching for the parts of event cards that rarely change.
+
+Rendering a card runs markdown over the description and a macro per attendee, which
+adds up over a long list of (mostly past) events. The rendered HTML is keyed on
+everything it depends on, so entries are never served stale, even by other workers.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from flask import render_template
+from markupsafe import Markup
+
+from mountains.cache import LRUCache
+from mountains.context import current_user, table_generations
+from mountains.models.image_files import image_files_for, image_files_generation
+from mountains.utils import now_utc
+
+if TYPE_CHECKING:
+    from mountains.models.events import Attendee, Event, EventCounts
+    from mountains.models.users import User
+
+_fragments: LRUCache[tuple, Markup] = LRUCache(
+    name="event-fragments",
+    max_size=16 * 1024 * 1024,
+    size_of=len,
+)
+
+
+def event_body(event: Event) -> Markup:
+    """
+    The header and description of an event card.
+    """
+    key = ("body", event.id, event.updated_on_utc, current_user.role_class)
+    return _fragments.get_or_set(
+        key, lambda: Markup(render_template("events/_event.body.html.j2", event=event))
+    )
+
+
+def event_attendee_lists(
+    event: Event,
+    attendees: list[Attendee],
+    counts: EventCounts,
+    members: dict[int, User],
+) -> Markup:
+    """
+    The attending and waiting lists of an event card.
+    """
+
+    def render() -> Markup:
+        pictures = (members[a.user_id].profile_picture_url for a in attendees)
+        return Markup(
+            render_template(
+                "events/_event.attendee_lists.html.j2",
+                event=event,
+                attendees=attendees,
+                members=members,
+                image_files=image_files_for(Path(p) for p in pictures if p),
+            )
+        )
+
+    # Attendees can change their name or picture (but not by logging in, see
+    # migrations/0023), or have their membership expire
+    users = table_generations().get("users")
+    if users is None:
+        # We'd never know when this went stale
+        return render()
+
+    key = (
+        "attendees",
+        event.id,
+        counts.generation,
+        users.generation,
+        image_files_generation(),
+        now_utc().date(),
+        current_user.role_class,
+    )
+    return _fragments.get_or_set(key, render)
+
+
+def invalidate_event(event_id: int) -> None:
+    """
+    Frees anything cached for this event.
+
+    Not needed for correctness (the keys already change), but saves waiting for
+    the old entries to be evicted.
+    """
+    _fragments.discard_where(lambda key: key[1] == event_id)
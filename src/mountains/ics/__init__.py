@@ -5,17 +5,20 @@ Note that these are public routes, so are managed by tokens generated by logged
 """
 
 import datetime
+import hashlib
 import logging
 from typing import List
 from zoneinfo import ZoneInfo
 
 from attr import define
-from flask import Blueprint, Response, abort, request, url_for
+from flask import Blueprint, Response, abort, current_app, request, url_for
 from icalendar import Calendar
 from icalendar import Event as ICalEvent
 
-from mountains.context import db_conn
-from mountains.models.events import Event, attendees_repo, events_repo
+from mountains.cache import LRUCache
+from mountains.context import db_conn, table_generations
+from mountains.models.events import Event, events_for_user, events_repo
+from mountains.models.generations import user_events_generations_repo
 from mountains.models.tokens import tokens_ics_repo
 from mountains.models.users import users_repo
 
@@ -27,58 +30,112 @@ logger = logging.getLogger(__name__)
 def calendar():
     """
     Returns the calendar for all events (from 1 month before today)
+
+    This is the same for everyone, so is cached until any event changes.
     """
     _user_id_from_token_or_401()
     date_cut_off = (datetime.date.today() - datetime.timedelta(days=31)).strftime(
         "%Y-%m-%d"
     )
-    with db_conn() as conn:
-        events = [
-            _EventWithIsWaitingList(event=event, is_waiting_list=False)
-            for event in events_repo(conn).list_where(
-                is_deleted=False, is_draft=False, event_dt=(">", date_cut_off)
-            )
-        ]
-    return _ics_response(
-        name="All CMC Events",
-        events=events,
-        description="All upcoming club events",
-    )
+    events_generation = table_generations().get("events")
+
+    def make_feed() -> _Feed:
+        with db_conn() as conn:
+            events = [
+                _EventWithIsWaitingList(event=event, is_waiting_list=False)
+                for event in events_repo(conn).list_where(
+                    is_deleted=False, is_draft=False, event_dt=(">", date_cut_off)
+                )
+            ]
+        return _ics_feed(
+            name="All CMC Events",
+            events=events,
+            description="All upcoming club events",
+            last_modified=events_generation and events_generation.updated_utc,
+        )
+
+    if events_generation is None:
+        # We'd never know when this went stale
+        return _feed_response(make_feed())
+
+    # URLs in the feed are for the host it was requested on
+    key = ("calendar", events_generation.generation, date_cut_off, request.host_url)
+    return _feed_response(_feeds.get_or_set(key, make_feed))
 
 
 @blueprint.route("/user-calendar.ics")
 def user_calendar():
     """
-    Returns the calendar for all events this user has been to
+    Returns the calendar for all events this user has been to (going back
+    `CMC_ICS_HISTORY_DAYS`)
+
+    This is cached per user until their events change.
     """
     user_id = _user_id_from_token_or_401()
+    since = datetime.datetime.combine(
+        datetime.date.today()
+        - datetime.timedelta(days=current_app.config["CMC_ICS_HISTORY_DAYS"]),
+        datetime.time(0),
+    )
     with db_conn() as conn:
-        user_events = [
-            _EventWithIsWaitingList(event=event, is_waiting_list=att.is_waiting_list)
-            for att in attendees_repo(conn).list_where(user_id=user_id)
-            if (event := events_repo(conn).get(id=att.event_id)) is not None
-        ]
-    return _ics_response(
-        name="My CMC Events",
-        events=user_events,
-        description="Upcoming club events you are attending or wait-listed for",
+        generation = user_events_generations_repo(conn).get(user_id=user_id)
+
+    def make_feed() -> _Feed:
+        with db_conn() as conn:
+            user_events = [
+                _EventWithIsWaitingList(
+                    event=event, is_waiting_list=attendee.is_waiting_list
+                )
+                for event, attendee in events_for_user(conn, user_id, since=since)
+            ]
+        return _ics_feed(
+            name="My CMC Events",
+            events=user_events,
+            description="Upcoming club events you are attending or wait-listed for",
+            last_modified=generation.updated_utc if generation else None,
+        )
+
+    key = (
+        "user-calendar",
+        user_id,
+        generation.generation if generation else 0,
+        since,
+        request.host_url,
     )
+    return _feed_response(_feeds.get_or_set(key, make_feed))
+
+
+# Calendar apps poll often, so remember who tokens belong to for a while. Tokens
+# and users are only ever deleted by hand, so a few minutes out of date is fine.
+_valid_tokens = LRUCache(name="ics-tokens", max_size=10_000, ttl_secs=300)
+# And which tokens are bad, so anyone guessing them doesn't reach the DB either
+_invalid_tokens = LRUCache(name="ics-tokens-invalid", max_size=10_000, ttl_secs=300)
 
 
 def _user_id_from_token_or_401() -> int:
     token_str = request.args.get("token")
     if not token_str:
         abort(401)
+
+    if (user_id := _valid_tokens.get(token_str)) is not None:
+        return user_id
+    if _invalid_tokens.get(token_str):
+        abort(401)
+
     with db_conn() as conn:
         token_repo = tokens_ics_repo(conn)
         token = token_repo.get(id=token_str)
         if token is None:
+            _invalid_tokens.set(token_str, True)
             abort(401)
         user = users_repo(conn).get(id=token.user_id)
         if user is None:
-            logger.warning("Removing token for missing user ID: {user_id}")
+            logger.warning("Removing token for missing user ID: %s", token.user_id)
             token_repo.delete_where(id=token_str)
+            _invalid_tokens.set(token_str, True)
             abort(401)
+
+    _valid_tokens.set(token_str, user.id)
     return user.id
 
 
@@ -88,9 +145,25 @@ class _EventWithIsWaitingList:
     is_waiting_list: bool
 
 
-def _ics_response(
-    name: str, events: List[_EventWithIsWaitingList], description: str | None = None
-) -> Response:
+@define(frozen=True)
+class _Feed:
+    body: bytes
+    etag: str
+    last_modified: datetime.datetime | None
+
+
+# Serialised feeds, keyed on whatever they were built from
+_feeds = LRUCache(
+    name="ics-feeds", max_size=16 * 1024 * 1024, size_of=lambda f: len(f.body)
+)
+
+
+def _ics_feed(
+    name: str,
+    events: List[_EventWithIsWaitingList],
+    description: str | None = None,
+    last_modified: datetime.datetime | None = None,
+) -> _Feed:
     london = ZoneInfo("Europe/London")
     cal = Calendar()
     cal.add("prodid", f"-//clydemc.org//{name}")
@@ -122,8 +195,27 @@ def _ics_response(
         ical_event.add("last-modified", event.updated_on_utc)
         cal.add_component(ical_event)
     cal.add_missing_timezones()
-    return Response(
-        cal.to_ical(),
+
+    body = cal.to_ical()
+    return _Feed(
+        body=body,
+        etag=hashlib.sha1(body).hexdigest(),
+        last_modified=last_modified,
+    )
+
+
+def _feed_response(feed: _Feed) -> Response:
+    """
+    Serves the feed, or a 304 if the client already has this version.
+    """
+    response = Response(
+        feed.body,
         mimetype="text/calendar; charset=utf-8",
         headers={"Content-Disposition": "inline"},
     )
+    # The body is exactly the same for the same etag, so this can be strong
+    response.set_etag(feed.etag)
+    if feed.last_modified is not None:
+        response.last_modified = feed.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
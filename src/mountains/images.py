@@ -0,0 +1,236 @@
+"""
+Resized copies of uploaded images.
+
+Each source is decoded once, at the lowest resolution that covers the largest
+size wanted. For JPEGs that means draft mode, where the decoder itself scales
+down by 1/2, 1/4 or 1/8, which is much cheaper than decoding every pixel of a
+phone photo. The EXIF orientation is applied once. Each size is then resized
+from the next larger one, rather than from the full image each time.
+
+Alongside each copy in the source's own format, smaller WebP and AVIF versions
+are saved for browsers which support them (see `ImageSet`).
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from attrs import frozen
+from PIL import ExifTags, Image, ImageOps, features
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Mapping
+
+logger = logging.getLogger(__name__)
+
+# EXIF orientations which turn the image on its side
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+# Resizes via `reduce` to within this factor of the target size first
+_REDUCING_GAP = 3.0
+
+# Smaller formats than JPEG or PNG, best first, if this Pillow can write them
+MODERN_FORMATS = [f for f in ("AVIF", "WEBP") if features.check(f.lower())]
+# The target's own format (None), and the modern ones
+ALL: list[str | None] = [None, *MODERN_FORMATS]
+_SUFFIXES = {"AVIF": ".avif", "WEBP": ".webp"}
+_MIME_TYPES = {"AVIF": "image/avif", "WEBP": "image/webp"}
+
+# Tuned for photos viewed on screen. No EXIF is ever saved (e.g. locations).
+_SAVE_OPTIONS: dict[str, dict] = {
+    "JPEG": {"quality": 80, "optimize": True, "progressive": True},
+    "WEBP": {"quality": 75, "method": 4},
+    "AVIF": {"quality": 55, "speed": 6},
+}
+
+
+@frozen
+class SavedImage:
+    path: Path
+    width: int
+    height: int
+    bytes: int
+    format: str
+
+
+@frozen
+class ImageVariant:
+    # Relative to static
+    path: Path
+    width: int
+
+
+@frozen
+class ImageSet:
+    """
+    All the sizes and formats an image is available in, for `<picture>` markup
+    (see macros/picture.html.j2).
+    """
+
+    # In the original format, for browsers without srcset support
+    fallback: Path
+    # Format (None for the original) -> variants, smallest first
+    variants: dict[str | None, list[ImageVariant]]
+
+    @property
+    def sources(self) -> list[tuple[str, list[ImageVariant]]]:
+        """
+        (MIME type, variants) for each modern format, best first.
+
+        Formats still missing some sizes are left out, else browsers would use
+        them even when they're too small.
+        """
+        widths = {v.width for v in self.original}
+        return [
+            (_MIME_TYPES[f], self.variants[f])
+            for f in MODERN_FORMATS
+            if self.variants.get(f) and {v.width for v in self.variants[f]} >= widths
+        ]
+
+    @property
+    def original(self) -> list[ImageVariant]:
+        return self.variants.get(None, [])
+
+
+def variant_path(path: Path, format: str | None) -> Path:
+    """
+    Where the copy of the image at `path` in `format` goes (None is as is).
+    """
+    return path if format is None else path.with_suffix(_SUFFIXES[format])
+
+
+def describe(path: Path) -> SavedImage:
+    """
+    The size and format of an existing image, reading only its header.
+    """
+    with Image.open(path) as im:
+        width, height = im.size
+        if im.getexif().get(ExifTags.Base.Orientation) in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+        format = im.format or ""
+    return SavedImage(path, width, height, path.stat().st_size, format)
+
+
+def perceptual_hash(path: Path) -> int:
+    """
+    A 64-bit difference hash of the image, which barely changes when it's resized,
+    recompressed or lightly edited, so near copies can be found with
+    `hash_distance`. Signed, to fit in an SQLite INTEGER.
+
+    Works from any size of the image, though is quickest from a small one.
+    """
+    with Image.open(path) as im:
+        im.draft("L", (64, 64))
+        # Each bit is whether a pixel is brighter than the one to its right
+        small = im.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits - (1 << 64) if bits >= (1 << 63) else bits
+
+
+def hash_distance(a: int, b: int) -> int:
+    """
+    How many bits of two perceptual hashes differ, from 0 (the same) to 64.
+    """
+    return ((a ^ b) & ((1 << 64) - 1)).bit_count()
+
+
+def resize_widths(
+    source: Path, targets: Mapping[int, Path], formats: Iterable[str | None] = ALL
+) -> list[SavedImage]:
+    """
+    Saves a copy of `source` at each width in `targets`, keeping its aspect
+    ratio, in each of `formats` (None being the target's own). Images are never
+    scaled up, so may be narrower than asked for.
+    """
+    saved = []
+    widest = max(targets)
+    with _open(source, lambda w, _: widest / w) as im:
+        for width in sorted(targets, reverse=True):
+            if im.width > width:
+                height = max(1, round(im.height * width / im.width))
+                im = im.resize((width, height), reducing_gap=_REDUCING_GAP)
+            saved.extend(_save_all(im, targets[width], formats))
+    return saved
+
+
+def fit_squares(
+    source: Path, targets: Mapping[int, Path], formats: Iterable[str | None] = ALL
+) -> list[SavedImage]:
+    """
+    Saves a copy of `source` cropped to a square around its centre, and resized
+    to each size in `targets`, in each of `formats` (None being the target's own).
+    """
+    saved = []
+    largest = max(targets)
+    with _open(source, lambda w, h: largest / min(w, h)) as im:
+        for size in sorted(targets, reverse=True):
+            side = min(im.size)
+            left, top = (im.width - side) // 2, (im.height - side) // 2
+            im = im.resize(
+                (size, size),
+                box=(left, top, left + side, top + side),
+                reducing_gap=_REDUCING_GAP,
+            )
+            saved.extend(_save_all(im, targets[size], formats))
+    return saved
+
+
+def _open(source: Path, scale_for: Callable[[int, int], float]) -> Image.Image:
+    """
+    Decodes the image, the right way up, at no less than `scale_for(width,
+    height)` of its full size.
+    """
+    im = Image.open(source)
+    width, height = im.size
+    if im.getexif().get(ExifTags.Base.Orientation) in _ROTATED_ORIENTATIONS:
+        width, height = height, width
+
+    scale = scale_for(width, height)
+    if scale < 1:
+        # The draft is never smaller than asked for, in either dimension
+        im.draft(im.mode, (math.ceil(im.width * scale), math.ceil(im.height * scale)))
+
+    try:
+        ImageOps.exif_transpose(im, in_place=True)
+    except Exception:
+        logger.exception("Failed to apply EXIF orientation to %s", source)
+    return im
+
+
+def _save_all(
+    im: Image.Image, path: Path, formats: Iterable[str | None]
+) -> list[SavedImage]:
+    saved = []
+    for format in formats:
+        if format is None:
+            format = Image.registered_extensions().get(path.suffix.lower(), "")
+            saved.append(_save(im, path, format))
+        else:
+            saved.append(_save(im, variant_path(path, format), format))
+    return saved
+
+
+def _save(im: Image.Image, path: Path, format: str) -> SavedImage:
+    # Formats like JPEG can't store transparency or palettes
+    if format == "JPEG" and im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+
+    # Written alongside then moved, so it's never seen half written. This also
+    # allows overwriting the source. Named uniquely, as other processes may be
+    # saving the same image at once.
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        im.save(tmp_path, format=format or None, **_SAVE_OPTIONS.get(format, {}))
+        num_bytes = tmp_path.stat().st_size
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return SavedImage(path, im.width, im.height, num_bytes, format)
@@ -13,11 +13,13 @@ from flask import (
     request,
     url_for,
 )
-from PIL import Image, ImageOps
 from werkzeug.datastructures import FileStorage
 
+from mountains import images
 from mountains.context import current_user, db_conn, send_mail
+from mountains.models.image_files import ImageFile, record_image_files
 from mountains.models.kit import (
+    KIT_WIDTHS,
     KitDetail,
     KitGroup,
     KitItem,
@@ -100,11 +102,12 @@ def kit_details(id: int):
             pic = request.files["photo_path"]
             next_id = kit_detail_db.next_id()
             if pic.filename:
-                photo_path = _upload_kit_image(
+                photo_path, image_files = _upload_kit_image(
                     filename=f"{next_id}-kit-detail",
                     file=pic,
                     static_dir=Path(current_app.config["STATIC_FOLDER"]),
                 )
+                record_image_files(conn, image_files)
             else:
                 photo_path = None
 
@@ -145,7 +148,7 @@ def _upload_kit_image(
     filename: str,
     file: FileStorage,
     static_dir: Path,
-) -> str:
+) -> tuple[str, list[ImageFile]]:
     assert file.filename is not None, (
         "upload_profile should always have a file.filename attribute"
     )
@@ -155,24 +158,19 @@ def _upload_kit_image(
         upload_path.parent.mkdir()
     file.save(upload_path)
 
-    for new_width in [256, 512, 1200]:
-        with Image.open(upload_path) as im:
-            if im.width > new_width:
-                new_height = int(im.height * (new_width / im.width))
-                resized = im.resize((new_width, new_height))
-                try:
-                    ImageOps.exif_transpose(resized, in_place=True)
-                except Exception as e:
-                    logger.exception(
-                        "Exception while transposing newly uploaded kit image.",
-                        exc_info=e,
-                    )
-                target_path = upload_path.with_stem(f"{upload_path.stem}-{new_width}")
-
-                logger.info("Saving image to %s", target_path)
-                resized.save(target_path)
+    logger.info("Saving resized images of %s", upload_path)
+    saved = images.resize_widths(
+        upload_path,
+        {
+            new_width: upload_path.with_stem(f"{upload_path.stem}-{new_width}")
+            for new_width in KIT_WIDTHS
+        },
+    )
 
-    return str(Path("kit-photos") / full_filename)
+    photo_path = Path("kit-photos") / full_filename
+    return str(photo_path), [
+        ImageFile.from_saved(static_dir, photo_path, s) for s in saved
+    ]
 
 
 @blueprint.route("/add/", methods=["GET", "POST"])
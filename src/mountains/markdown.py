@@ -0,0 +1,61 @@
+"""
+Rendering markdown to HTML, cached on a hash of the markdown.
+
+The same text (the front page, popups, event descriptions) is rendered on most
+requests, so the HTML is kept in memory, and optionally in a SQLite file set by
+`CMC_MARKDOWN_CACHE_DB` so it survives gunicorn recycling workers.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from typing import TYPE_CHECKING
+
+import mistune
+from attrs import define
+
+from mountains.cache import LRUCache, SQLiteCache
+
+if TYPE_CHECKING:
+    from typing import Self
+
+    from flask import Flask
+
+
+@define
+class MarkdownRenderer:
+    memory: LRUCache[str, str]
+    persistent: SQLiteCache | None = None
+
+    @classmethod
+    def from_app(cls, app: Flask) -> Self:
+        if path := app.config.get("CMC_MARKDOWN_CACHE_DB"):
+            persistent = SQLiteCache(
+                name="markdown-sqlite", path=path, max_entries=10_000
+            )
+        else:
+            persistent = None
+
+        return cls(
+            memory=LRUCache(name="markdown", max_size=8 * 1024 * 1024, size_of=len),
+            persistent=persistent,
+        )
+
+    def render(self, s: str) -> str:
+        # Include the version, as stored HTML might be from an older mistune
+        key = hashlib.sha256(f"{mistune.__version__}\0{s}".encode()).hexdigest()
+
+        html = self.memory.get(key)
+        if html is not None:
+            return html
+
+        if self.persistent is not None:
+            html = self.persistent.get(key)
+
+        if html is None:
+            html = mistune.html(s)  # type: ignore
+            if self.persistent is not None:
+                self.persistent.set(key, html)
+
+        self.memory.set(key, html)
+        return html
@@ -12,11 +12,13 @@ from flask import (
     url_for,
 )
 from requests.exceptions import ConnectionError
-from werkzeug.security import generate_password_hash
 
-from mountains.context import current_user, db_conn
+from mountains.conditional import conditional_get
+from mountains.context import current_user, db_conn, password_hasher
 from mountains.discord import DiscordAPI
-from mountains.models.events import attendees_repo, events_repo
+from mountains.errors import MountainException
+from mountains.models.events import attendees_repo, events_repo, trial_tallies
+from mountains.models.image_files import image_files_for, record_image_files
 from mountains.models.users import CommitteeRole, User, upload_profile, users_repo
 from mountains.utils import str_to_bool
 
@@ -30,6 +32,7 @@ blueprint = Blueprint(
 
 
 @blueprint.route("/")
+@conditional_get("users", "image_files")
 def members():
     with db_conn() as conn:
         members = users_repo(conn).list_where(is_dormant=False)
@@ -40,13 +43,21 @@ def members():
 
     members = sorted(members, key=_member_sort_key)
     limit = int(request.args.get("limit", 25))
+    image_files = image_files_for(
+        Path(m.profile_picture_url) for m in members[:limit] if m.profile_picture_url
+    )
 
     return render_template(
-        "members/members.html.j2", members=members, search=search, limit=limit
+        "members/members.html.j2",
+        members=members,
+        search=search,
+        limit=limit,
+        image_files=image_files,
     )
 
 
 @blueprint.route("/<slug>/", methods=["GET", "POST"])
+@conditional_get("users", "user_logins", "events", "attendees", "image_files")
 def member(slug: str):
     if request.method == "POST":
         with db_conn() as conn:
@@ -99,6 +110,11 @@ def member(slug: str):
             if not att.is_waiting_list
         ]
 
+        if user.is_member:
+            trial_tally = None
+        else:
+            trial_tally = trial_tallies(conn, [user.id])[user.id]
+
     num_attended = request.args.get("num_attended", type=int, default=20)
     attended = sorted(
         [e for e in attended if e is not None and not e.is_deleted],
@@ -125,6 +141,7 @@ def member(slug: str):
         discord_name=discord_name,
         attended=attended,
         num_attended=num_attended,
+        trial_tally=trial_tally,
     )
 
 
@@ -213,11 +230,12 @@ def edit_member(id: int):
     message = None
     if request.method == "POST":
         updates = {}
+        image_files = []
 
         if "profile_picture" in request.files:
             pic = request.files["profile_picture"]
             if pic.filename:
-                updates["profile_picture_url"] = upload_profile(
+                updates["profile_picture_url"], image_files = upload_profile(
                     file=request.files["profile_picture"],
                     static_dir=Path(current_app.config["STATIC_FOLDER"]),
                     user=user,
@@ -226,9 +244,12 @@ def edit_member(id: int):
                 message = "No photo found to upload!"
         elif "password" in request.form:
             if request.form["password"] == request.form["confirm_password"]:
-                updates["password_hash"] = generate_password_hash(
-                    request.form["password"]
-                )
+                try:
+                    updates["password_hash"] = password_hasher().hash(
+                        request.form["password"]
+                    )
+                except MountainException as e:
+                    message = str(e)
             else:
                 message = "Passwords do not match!"
         else:
@@ -251,8 +272,9 @@ def edit_member(id: int):
                         updates[field] = request.form[field]
 
         if updates:
-            with db_conn() as conn:
+            with db_conn(locked=True) as conn:
                 users_repo(conn).update(id=user.id, **updates)
+                record_image_files(conn, image_files)
 
             # TODO: Flash message
 
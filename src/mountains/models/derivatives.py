@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import datetime
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from attrs import Factory, define
+from cattrs import structure
+
+from mountains.db import Repository
+from mountains.utils import now_utc
+
+if TYPE_CHECKING:
+    from sqlite3 import Connection
+    from typing import Iterable
+
+
+@define
+class DerivativeJob:
+    """
+    Copies of an uploaded image at one width (in every format) still to be made, by
+    the background worker in `mountains.derivatives`.
+    """
+
+    id: int
+    # Relative to static, like Photo.photo_path
+    source_path: Path
+    width: int
+    created_utc: datetime.datetime = Factory(now_utc)
+    attempts: int = 0
+    # Set while a worker is on it. If that worker dies, the job is retried after.
+    claimed_until_utc: datetime.datetime | None = None
+
+
+def derivative_jobs_repo(conn: Connection) -> Repository[DerivativeJob]:
+    return Repository(
+        conn=conn,
+        table_name="derivative_jobs",
+        schema=[
+            "id INTEGER PRIMARY KEY",
+            "source_path TEXT NOT NULL",
+            "width INTEGER NOT NULL",
+            "created_utc DATETIME NOT NULL",
+            "attempts INTEGER NOT NULL DEFAULT 0",
+            "claimed_until_utc DATETIME",
+            "UNIQUE(source_path, width)",
+        ],
+        storage_cls=DerivativeJob,
+    )
+
+
+def enqueue_derivatives(
+    conn: Connection, source_paths: Iterable[Path], widths: Iterable[int]
+) -> None:
+    """
+    Queues every width of every source, skipping any already queued.
+    """
+    conn.execute(
+        """
+        INSERT INTO derivative_jobs (source_path, width, created_utc)
+        SELECT paths.value, widths.value, :now
+        FROM json_each(:paths) AS paths, json_each(:widths) AS widths
+        WHERE true
+        ON CONFLICT DO NOTHING
+        """,
+        {
+            "paths": json.dumps([str(p) for p in source_paths]),
+            "widths": json.dumps(list(widths)),
+            "now": now_utc().isoformat(),
+        },
+    )
+
+
+def claim_derivative_job(
+    conn: Connection, claim_secs: float, max_attempts: int
+) -> DerivativeJob | None:
+    """
+    Takes the oldest job that no other worker has claimed, so it isn't made twice.
+    """
+    now = now_utc()
+    params = {
+        "now": now.isoformat(),
+        "claimed_until": (now + datetime.timedelta(seconds=claim_secs)).isoformat(),
+        "max_attempts": max_attempts,
+    }
+    available = """
+        (claimed_until_utc IS NULL OR claimed_until_utc < :now)
+        AND attempts < :max_attempts
+    """
+
+    # Checked first, so an empty queue only ever needs a read
+    cur = conn.execute(
+        f"SELECT 1 FROM derivative_jobs WHERE {available} LIMIT 1", params
+    )
+    if cur.fetchone() is None:
+        return None
+
+    row = conn.execute(
+        f"""
+        UPDATE derivative_jobs
+        SET attempts = attempts + 1, claimed_until_utc = :claimed_until
+        WHERE id = (
+            SELECT id FROM derivative_jobs WHERE {available} ORDER BY id LIMIT 1
+        )
+        RETURNING *
+        """,
+        params,
+    ).fetchone()
+
+    if row is None:
+        return None
+    else:
+        return structure(dict(row), DerivativeJob)
+
+
+def release_derivative_job(conn: Connection, job: DerivativeJob) -> None:
+    """
+    Lets a failed job be retried straight away (up to its max attempts).
+    """
+    derivative_jobs_repo(conn).update(id=job.id, claimed_until_utc=None)
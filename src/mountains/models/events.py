@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import datetime
 import enum
+import json
 import sqlite3
 import zoneinfo
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-from attrs import Factory, define
+from attrs import Factory, define, field, fields
+from cattrs import structure
 from werkzeug.datastructures import FileStorage
 
 from mountains.db import Repository
@@ -36,6 +38,16 @@ class EventType(enum.Enum):
 
 sqlite3.register_adapter(EventType, lambda x: x.value)
 
+# Events which count towards a non-member's trial period
+TRIAL_EVENT_TYPES = [
+    EventType.SUMMER_DAY_WALK,
+    EventType.SUMMER_WEEKEND,
+    EventType.WINTER_DAY_WALK,
+    EventType.WINTER_WEEKEND,
+    EventType.OUTDOOR_CLIMBING,
+    EventType.RUNNING,
+]
+
 
 @define(kw_only=True)
 class Event:
@@ -61,14 +73,14 @@ class Event:
     def __str__(self):
         return self.slug
 
-    def is_full(self, attendees: list[Attendee]) -> bool:
-        if any(a.is_waiting_list for a in attendees):
+    def is_full(self, counts: EventCounts) -> bool:
+        if counts.num_waiting > 0:
             return True
 
         if self.max_attendees is None or self.max_attendees == 0:
             return False
         else:
-            return len(attendees) >= self.max_attendees
+            return counts.num_attending >= self.max_attendees
 
     def is_upcoming_on(self, dt: datetime.date) -> bool:
         return self.event_dt.date() >= dt or (
@@ -119,14 +131,7 @@ class Event:
                 return not attendee.is_trip_paid
 
     def is_part_of_trial(self) -> bool:
-        return self.event_type in [
-            EventType.SUMMER_DAY_WALK,
-            EventType.SUMMER_WEEKEND,
-            EventType.WINTER_DAY_WALK,
-            EventType.WINTER_WEEKEND,
-            EventType.OUTDOOR_CLIMBING,
-            EventType.RUNNING,
-        ]
+        return self.event_type in TRIAL_EVENT_TYPES
 
     @classmethod
     def from_form(
@@ -238,6 +243,47 @@ class Attendee:
     is_trip_paid: bool = False
 
 
+@define(kw_only=True)
+class EventCounts:
+    """
+    Attendance totals for an event.
+
+    These are kept up to date by triggers on the attendees table (see
+    migrations/0009), so are always consistent with it inside a transaction.
+    """
+
+    event_id: int
+    num_attending: int = 0
+    num_waiting: int = 0
+    # Only counts those attending, not anyone on the waiting list
+    num_paid: int = 0
+    # Bumped on every change to the event's attendees, for keying caches
+    generation: int = field(default=0, eq=False)
+
+    @property
+    def num_unpaid(self) -> int:
+        return self.num_attending - self.num_paid
+
+
+@define(kw_only=True)
+class TrialTally:
+    """
+    How many finished trial events a user has attended.
+
+    These are counted lazily by `trial_tallies`. Triggers on attendees and events
+    delete a user's row whenever it may have changed (see migrations/0012), and
+    `stale_on` is the day after the next event they're going to finishes, when it
+    needs counting again.
+    """
+
+    user_id: int
+    num_trial_events: int = 0
+    stale_on: datetime.date | None = None
+
+    def is_current_on(self, dt: datetime.date) -> bool:
+        return self.stale_on is None or dt < self.stale_on
+
+
 def events_repo(conn: sqlite3.Connection) -> Repository[Event]:
     return Repository(
         conn=conn,
@@ -263,9 +309,84 @@ def events_repo(conn: sqlite3.Connection) -> Repository[Event]:
             "map_path TEXT",
         ],
         storage_cls=Event,
+        indexes=[
+            # Lets us range-scan on when an event finishes (see events_overlapping)
+            "CREATE INDEX IF NOT EXISTS events_finish_dt"
+            " ON events(COALESCE(event_end_dt, event_dt))",
+            # For the latest edit, in page ETags (see conditional_get)
+            "CREATE INDEX IF NOT EXISTS events_updated_on_utc ON events(updated_on_utc)",
+        ],
     )
 
 
+def events_overlapping(
+    conn: sqlite3.Connection,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    include_drafts: bool = False,
+) -> list[Event]:
+    """
+    Non-deleted events happening at any point in [start, end), including multi-day
+    events that started before `start`, in start order.
+
+    This uses the events_finish_dt index, so only scans events finishing after
+    `start` rather than the whole history.
+    """
+    where = """
+        COALESCE(event_end_dt, event_dt) >= :start
+        AND event_dt < :end
+        AND is_deleted = false
+    """
+    if not include_drafts:
+        where += " AND is_draft = false"
+
+    return events_repo(conn).select(
+        where,
+        {"start": start.isoformat(), "end": end.isoformat()},
+        order_by="event_dt",
+    )
+
+
+def events_for_user(
+    conn: sqlite3.Connection,
+    user_id: int,
+    since: datetime.datetime | None = None,
+) -> list[tuple[Event, Attendee]]:
+    """
+    Non-deleted events a user is attending or wait-listed for, which started after
+    `since`, in start order.
+    """
+    columns = [f"events.{f.name} AS 'event.{f.name}'" for f in fields(Event)] + [
+        f"attendees.{f.name} AS 'attendee.{f.name}'" for f in fields(Attendee)
+    ]
+    where = "attendees.user_id = :user_id AND events.is_deleted = false"
+    if since is not None:
+        where += " AND events.event_dt > :since"
+
+    rows = conn.execute(
+        f"""
+        SELECT {", ".join(columns)}
+        FROM attendees
+        JOIN events ON events.id = attendees.event_id
+        WHERE {where}
+        ORDER BY events.event_dt
+        """,
+        {"user_id": user_id, "since": since.isoformat() if since else None},
+    ).fetchall()
+
+    return [
+        (
+            structure(_unprefix(row, "event."), Event),
+            structure(_unprefix(row, "attendee."), Attendee),
+        )
+        for row in rows
+    ]
+
+
+def _unprefix(row: sqlite3.Row, prefix: str) -> dict:
+    return {k.removeprefix(prefix): row[k] for k in row.keys() if k.startswith(prefix)}
+
+
 def attendees_repo(conn: sqlite3.Connection) -> Repository[Attendee]:
     return Repository(
         conn=conn,
@@ -281,4 +402,200 @@ def attendees_repo(conn: sqlite3.Connection) -> Repository[Attendee]:
             "FOREIGN KEY(event_id) REFERENCES events(id)",
         ],
         storage_cls=Attendee,
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS attendees_event_id ON attendees(event_id)",
+        ],
+    )
+
+
+def event_counts_repo(conn: sqlite3.Connection) -> Repository[EventCounts]:
+    return Repository(
+        conn=conn,
+        table_name="event_counts",
+        schema=[
+            "event_id INTEGER PRIMARY KEY",
+            "num_attending INTEGER NOT NULL DEFAULT 0",
+            "num_waiting INTEGER NOT NULL DEFAULT 0",
+            "num_paid INTEGER NOT NULL DEFAULT 0",
+            "generation INTEGER NOT NULL DEFAULT 0",
+            "FOREIGN KEY(event_id) REFERENCES events(id)",
+        ],
+        storage_cls=EventCounts,
+        id_col="event_id",
+    )
+
+
+# Shared by the checker and the rebuild, and matches the attendees triggers
+_COUNTS_QUERY = """
+    SELECT
+        event_id,
+        COUNT(*) FILTER (WHERE NOT is_waiting_list) AS num_attending,
+        COUNT(*) FILTER (WHERE is_waiting_list) AS num_waiting,
+        COUNT(*) FILTER (WHERE is_trip_paid AND NOT is_waiting_list) AS num_paid
+    FROM attendees
+    GROUP BY event_id
+"""
+
+
+def event_counts(
+    conn: sqlite3.Connection, event_ids: list[int]
+) -> dict[int, EventCounts]:
+    """
+    Counts for each event id, defaulting to zeros for events without attendees.
+    """
+    counts = {
+        c.event_id: c for c in event_counts_repo(conn).get_all(event_id=event_ids)
+    }
+    return {
+        event_id: counts.get(event_id, EventCounts(event_id=event_id))
+        for event_id in event_ids
+    }
+
+
+def check_event_counts(
+    conn: sqlite3.Connection,
+) -> list[tuple[EventCounts, EventCounts]]:
+    """
+    Compares the stored counts against the attendees table.
+
+    Returns a list of (stored, actual) pairs for each event that differs.
+    """
+    stored = {c.event_id: c for c in event_counts_repo(conn).list()}
+    actual = {
+        row["event_id"]: EventCounts(**dict(row))
+        for row in conn.execute(_COUNTS_QUERY).fetchall()
+    }
+
+    mismatches = []
+    for event_id in sorted(set(stored) | set(actual)):
+        # A missing row is the same as all zeros
+        stored_counts = stored.get(event_id, EventCounts(event_id=event_id))
+        actual_counts = actual.get(event_id, EventCounts(event_id=event_id))
+        if stored_counts != actual_counts:
+            mismatches.append((stored_counts, actual_counts))
+
+    return mismatches
+
+
+def rebuild_event_counts(conn: sqlite3.Connection) -> None:
+    """
+    Recomputes every stored count from the attendees table.
+
+    Generations are bumped rather than reset, so nothing cached against the old
+    counts can be mistaken for current.
+
+    Should be run in a locked connection so no attendees change part way through.
+    """
+    conn.execute("""
+        UPDATE event_counts
+        SET num_attending = 0, num_waiting = 0, num_paid = 0,
+            generation = generation + 1
+    """)
+    conn.execute(f"""
+        INSERT INTO event_counts (event_id, num_attending, num_waiting, num_paid)
+        {_COUNTS_QUERY}
+        ON CONFLICT(event_id) DO UPDATE SET
+            num_attending = excluded.num_attending,
+            num_waiting = excluded.num_waiting,
+            num_paid = excluded.num_paid
+    """)
+
+
+def trial_tallies_repo(conn: sqlite3.Connection) -> Repository[TrialTally]:
+    return Repository(
+        conn=conn,
+        table_name="trial_tallies",
+        schema=[
+            "user_id INTEGER PRIMARY KEY",
+            "num_trial_events INTEGER NOT NULL DEFAULT 0",
+            "stale_on DATE",
+            "FOREIGN KEY(user_id) REFERENCES users(id)",
+        ],
+        storage_cls=TrialTally,
+        id_col="user_id",
+    )
+
+
+_TRIAL_TYPES_SQL = ", ".join(str(t.value) for t in TRIAL_EVENT_TYPES)
+
+# Counts and stores the tallies for a JSON list of user ids in one statement, so a
+# trigger can't clear a row between us counting and storing it
+_TRIAL_TALLY_QUERY = f"""
+    INSERT INTO trial_tallies (user_id, num_trial_events, stale_on)
+    SELECT
+        users.value,
+        COUNT(events.id) FILTER (
+            WHERE date(COALESCE(events.event_end_dt, events.event_dt)) < :today
+        ),
+        date(
+            MIN(COALESCE(events.event_end_dt, events.event_dt)) FILTER (
+                WHERE date(COALESCE(events.event_end_dt, events.event_dt)) >= :today
+            ),
+            '+1 day'
+        )
+    FROM json_each(:user_ids) AS users
+    LEFT JOIN attendees
+        ON attendees.user_id = users.value AND NOT attendees.is_waiting_list
+    LEFT JOIN events
+        ON events.id = attendees.event_id
+        AND NOT events.is_deleted
+        AND events.event_type IN ({_TRIAL_TYPES_SQL})
+    GROUP BY users.value
+    ON CONFLICT(user_id) DO UPDATE SET
+        num_trial_events = excluded.num_trial_events,
+        stale_on = excluded.stale_on
+    RETURNING user_id, num_trial_events, stale_on
+"""
+
+
+def trial_tallies(
+    conn: sqlite3.Connection,
+    user_ids: list[int],
+    today: datetime.date | None = None,
+) -> dict[int, TrialTally]:
+    """
+    Trial tallies for each user id, recounting any that are missing or stale.
+    """
+    if today is None:
+        today = now_utc().date()
+
+    tallies = {
+        t.user_id: t
+        for t in trial_tallies_repo(conn).get_all(user_id=user_ids)
+        if t.is_current_on(today)
+    }
+
+    if recount := [u for u in user_ids if u not in tallies]:
+        rows = conn.execute(
+            _TRIAL_TALLY_QUERY,
+            {"user_ids": json.dumps(recount), "today": today.isoformat()},
+        ).fetchall()
+        for row in rows:
+            tally = structure(dict(row), TrialTally)
+            tallies[tally.user_id] = tally
+
+    return {user_id: tallies[user_id] for user_id in user_ids}
+
+
+def past_trial_events(
+    conn: sqlite3.Connection, user_id: int, today: datetime.date | None = None
+) -> list[Event]:
+    """
+    The finished trial events a user attended, i.e. those counted in their tally.
+    """
+    if today is None:
+        today = now_utc().date()
+
+    return events_repo(conn).select(
+        f"""
+        id IN (
+            SELECT event_id FROM attendees
+            WHERE user_id = :user_id AND NOT is_waiting_list
+        )
+        AND NOT is_deleted
+        AND event_type IN ({_TRIAL_TYPES_SQL})
+        AND date(COALESCE(event_end_dt, event_dt)) < :today
+        """,
+        {"user_id": user_id, "today": today.isoformat()},
+        order_by="event_dt",
     )
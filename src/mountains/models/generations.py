@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import datetime
+from typing import TYPE_CHECKING
+
+from attrs import define
+
+from mountains.db import Repository
+
+if TYPE_CHECKING:
+    from sqlite3 import Connection
+
+
+@define
+class TableGeneration:
+    """
+    Bumped by triggers on every change to the named table (see migrations/0011),
+    except to when users last logged in, which bumps "user_logins" instead (see
+    migrations/0023).
+    """
+
+    name: str
+    generation: int
+    updated_utc: datetime.datetime
+
+
+def table_generations_repo(conn: Connection) -> Repository[TableGeneration]:
+    repo = Repository(
+        conn=conn,
+        table_name="table_generations",
+        schema=[
+            "name TEXT PRIMARY KEY",
+            "generation INTEGER NOT NULL DEFAULT 0",
+            "updated_utc DATETIME NOT NULL",
+        ],
+        storage_cls=TableGeneration,
+        id_col="name",
+    )
+
+    return repo
+
+
+@define
+class UserEventsGeneration:
+    """
+    Bumped by triggers on any change to a user's attendances, or to an event they
+    are attending (see migrations/0014).
+    """
+
+    user_id: int
+    generation: int
+    updated_utc: datetime.datetime
+
+
+def user_events_generations_repo(
+    conn: Connection,
+) -> Repository[UserEventsGeneration]:
+    repo = Repository(
+        conn=conn,
+        table_name="user_events_generations",
+        schema=[
+            "user_id INTEGER PRIMARY KEY",
+            "generation INTEGER NOT NULL DEFAULT 0",
+            "updated_utc DATETIME NOT NULL",
+            "FOREIGN KEY(user_id) REFERENCES users(id)",
+        ],
+        storage_cls=UserEventsGeneration,
+        id_col="user_id",
+    )
+
+    return repo
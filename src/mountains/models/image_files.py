@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from attrs import define, evolve
+from cattrs import unstructure
+from flask import g
+
+# Imported whole, as context imports models.users which imports this
+from mountains import context, images
+from mountains.cache import LRUCache
+from mountains.db import Repository
+from mountains.models.generations import table_generations_repo
+
+if TYPE_CHECKING:
+    from sqlite3 import Connection
+    from typing import Iterable, Mapping, Self
+
+
+@define
+class ImageFile:
+    """
+    An image file we've saved, so pages can link to every size and format of an
+    upload without checking what's on disk.
+    """
+
+    # Relative to static
+    path: Path
+    # What it was made from, e.g. Photo.photo_path or User.profile_picture_url
+    source_path: Path
+    width: int
+    height: int
+    bytes: int
+    format: str
+
+    @classmethod
+    def from_saved(
+        cls, static_dir: Path, source_path: Path, saved: images.SavedImage
+    ) -> Self:
+        return cls(
+            path=saved.path.relative_to(static_dir),
+            source_path=source_path,
+            width=saved.width,
+            height=saved.height,
+            bytes=saved.bytes,
+            format=saved.format,
+        )
+
+
+def image_files_repo(conn: Connection) -> Repository[ImageFile]:
+    return Repository(
+        conn=conn,
+        table_name="image_files",
+        schema=[
+            "path TEXT PRIMARY KEY",
+            "source_path TEXT NOT NULL",
+            "width INTEGER NOT NULL",
+            "height INTEGER NOT NULL",
+            "bytes INTEGER NOT NULL",
+            "format TEXT NOT NULL",
+        ],
+        storage_cls=ImageFile,
+        id_col="path",
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS image_files_source_path"
+            " ON image_files(source_path)",
+        ],
+    )
+
+
+def record_image_files(conn: Connection, files: Iterable[ImageFile]) -> None:
+    """
+    Adds the files, replacing any already recorded at the same paths.
+    """
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO image_files
+            (path, source_path, width, height, bytes, format)
+        VALUES (:path, :source_path, :width, :height, :bytes, :format)
+        """,
+        [unstructure(f) for f in files],
+    )
+
+
+def move_image_files(
+    conn: Connection, source_path: Path, new_source_path: Path
+) -> list[tuple[Path, Path]]:
+    """
+    Re-records the files made from `source_path` as made from `new_source_path`,
+    with the same names in its directory. Returns where each file was and should
+    now be, for moving them.
+    """
+    files_db = image_files_repo(conn)
+    files = files_db.list_where(source_path=str(source_path))
+    moved = [
+        evolve(
+            f, path=new_source_path.parent / f.path.name, source_path=new_source_path
+        )
+        for f in files
+    ]
+    files_db.delete_where(source_path=str(source_path))
+    record_image_files(conn, moved)
+    return [(f.path, m.path) for f, m in zip(files, moved)]
+
+
+# (source path, image_files generation) -> files
+_image_files = LRUCache(name="image-files", max_size=20_000)
+
+
+def image_files_generation() -> int | None:
+    """
+    Changes whenever files are recorded, for keying caches of anything that shows
+    them. Read once per request.
+    """
+    if "image_files_generation" not in g:
+        with context.db_conn() as conn:
+            generation = table_generations_repo(conn).get(name="image_files")
+        g.image_files_generation = generation and generation.generation
+    return g.image_files_generation
+
+
+def image_files_for(source_paths: Iterable[Path]) -> dict[Path, list[ImageFile]]:
+    """
+    Every file recorded as made from each of `source_paths`, with any not cached
+    looked up in one query. Views showing many images load them all with this, and
+    pass the result to each image's methods. Cached until any files are added.
+    """
+    source_paths = set(source_paths)
+    generation = image_files_generation()
+    found: dict[Path, list[ImageFile]] = {}
+    for source_path in source_paths:
+        files = _image_files.get((source_path, generation))
+        if files is not None:
+            found[source_path] = files
+
+    if missing := source_paths - found.keys():
+        loaded: dict[Path, list[ImageFile]] = {p: [] for p in missing}
+        with context.db_conn() as conn:
+            for file in image_files_repo(conn).get_all(
+                source_path=[str(p) for p in missing]
+            ):
+                loaded[file.source_path].append(file)
+        if generation is not None:
+            for source_path, files in loaded.items():
+                _image_files.set((source_path, generation), files)
+        found.update(loaded)
+    return found
+
+
+def source_image_files(
+    source_path: Path, files_by_source: Mapping[Path, list[ImageFile]] | None = None
+) -> list[ImageFile]:
+    """
+    Every file recorded as made from `source_path`, from `files_by_source` if it
+    was loaded there (see `image_files_for`), otherwise looked up alone.
+    """
+    if files_by_source is not None and source_path in files_by_source:
+        return files_by_source[source_path]
+    return image_files_for([source_path])[source_path]
+
+
+def to_image_set(fallback: Path, files: Iterable[ImageFile]) -> images.ImageSet:
+    """
+    An ImageSet of `files`, which should all be sizes and formats of one image.
+
+    If `fallback` isn't among them (e.g. it was saved before files were recorded),
+    it's shown alone, as browsers would otherwise only pick from the others.
+    """
+    files = list(files)
+    if not any(f.path == fallback for f in files):
+        return images.ImageSet(fallback, {})
+
+    variants: dict[str | None, list[images.ImageVariant]] = {}
+    for file in sorted(files, key=lambda f: f.width):
+        format = file.format if file.format in images.MODERN_FORMATS else None
+        format_variants = variants.setdefault(format, [])
+        # Small images aren't scaled up, so several sizes can be the same width
+        if not format_variants or format_variants[-1].width != file.width:
+            format_variants.append(images.ImageVariant(file.path, file.width))
+    return images.ImageSet(fallback, variants)
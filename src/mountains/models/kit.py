@@ -9,12 +9,18 @@ from typing import TYPE_CHECKING, Self
 from attrs import Factory, define
 from werkzeug.datastructures import ImmutableMultiDict
 
+from mountains import images
 from mountains.db import Repository
+from mountains.models.image_files import source_image_files, to_image_set
 
 if TYPE_CHECKING:
     from sqlite3 import Connection
 
 
+# Widths kit photos are resized to on upload
+KIT_WIDTHS = [256, 512, 1200]
+
+
 class KitGroup(enum.IntEnum):
     GENERAL = 1
     MAPS = 2
@@ -196,10 +202,28 @@ class KitDetail:
         assert self.photo_path is not None
         base = Path(self.photo_path)
         return {
-            width: str(base.with_stem(base.stem + f"-{width}"))
-            for width in [256, 512, 1200]
+            width: str(base.with_stem(base.stem + f"-{width}")) for width in KIT_WIDTHS
         }
 
+    def image_file_paths(self) -> list[Path]:
+        """
+        Everywhere a file made from the photo could be.
+        """
+        return [
+            images.variant_path(Path(path), f)
+            for path in self.photo_paths().values()
+            for f in images.ALL
+        ]
+
+    def image_set(self) -> images.ImageSet:
+        """
+        Every size and format of the photo made so far.
+        """
+        assert self.photo_path is not None
+        return to_image_set(
+            Path(self.photo_paths()[512]), source_image_files(Path(self.photo_path))
+        )
+
 
 def kit_details_repo(conn: Connection) -> Repository[KitDetail]:
     repo = Repository(
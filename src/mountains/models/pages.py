@@ -1,14 +1,18 @@
 from __future__ import annotations
 
+import json
 from typing import TYPE_CHECKING
 
+import mistune
 from attrs import define
+from markupsafe import Markup
 
 from mountains.db import Repository
 from mountains.errors import MountainException
 
 if TYPE_CHECKING:
     from sqlite3 import Connection
+    from typing import Iterable, Self
 
 
 @define
@@ -17,6 +21,21 @@ class Page:
     description: str
     markdown: str
     version: int
+    # Rendered from the markdown when published. Older pages may be missing this
+    # until they're first read (see `latest_pages`).
+    html: str | None = None
+
+    @classmethod
+    def publish(
+        cls, *, name: str, description: str, markdown: str, version: int
+    ) -> Self:
+        return cls(
+            name=name,
+            description=description,
+            markdown=markdown,
+            version=version,
+            html=mistune.html(markdown),  # type: ignore
+        )
 
 
 def pages_repo(conn: Connection) -> Repository[Page]:
@@ -28,6 +47,7 @@ def pages_repo(conn: Connection) -> Repository[Page]:
             "description TEXT NOT NULL",
             "markdown TEXT NOT NULL",
             "version INTEGER NOT NULL",
+            "html TEXT",
             "PRIMARY KEY(name, version)",
         ],
         storage_cls=Page,
@@ -37,12 +57,55 @@ def pages_repo(conn: Connection) -> Repository[Page]:
 
 
 def latest_page(name: str, repo: Repository[Page]) -> Page:
-    pages = repo.list_where(name=name)
-    try:
-        return max(pages, key=lambda p: p.version)
-    except ValueError:
+    # The primary key is on (name, version), so this is just an index lookup
+    pages = repo.select(
+        "name = :name", {"name": name}, order_by="version DESC", limit=1
+    )
+    if len(pages) == 0:
         raise MountainException(f"No page found with name {name}!")
+    else:
+        return pages[0]
+
+
+def latest_pages(
+    conn: Connection, names: Iterable[str] | None = None
+) -> dict[str, Page]:
+    """
+    The latest version of each named page (or every page if `names` is None) in
+    one query.
+
+    Any of these without pre-rendered html are rendered and saved now.
+    """
+    repo = pages_repo(conn)
+    latest = "version = (SELECT MAX(version) FROM pages AS p WHERE p.name = pages.name)"
+
+    if names is None:
+        pages = repo.select(latest)
+    else:
+        names = list(names)
+        pages = repo.select(
+            f"name IN (SELECT value FROM json_each(:names)) AND {latest}",
+            {"names": json.dumps(names)},
+        )
+        if missing := set(names) - set(p.name for p in pages):
+            raise MountainException(f"No page found with name {', '.join(missing)}!")
+
+    for page in pages:
+        if page.html is None:
+            page.html = mistune.html(page.markdown)  # type: ignore
+            repo.update(
+                _where={"name": page.name, "version": page.version}, html=page.html
+            )
+
+    return {p.name: p for p in pages}
+
+
+def latest_contents(conn: Connection, names: Iterable[str]) -> dict[str, Markup]:
+    """
+    The rendered HTML of the latest version of each named page.
+    """
+    return {name: Markup(page.html) for name, page in latest_pages(conn, names).items()}
 
 
-def latest_content(conn: Connection, name: str) -> str:
-    return latest_page(name, repo=pages_repo(conn)).markdown
+def latest_content(conn: Connection, name: str) -> Markup:
+    return latest_contents(conn, [name])[name]
@@ -1,25 +1,54 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import json
 import logging
+import os
 import sqlite3
+import time
 import uuid
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-from attrs import Factory, define
-from flask import current_app
-from PIL import Image, ImageOps
+from attrs import Factory, define, fields
+from cattrs import structure
 
+from mountains import images
+from mountains.context import db_conn
 from mountains.db import Repository
-from mountains.utils import now_utc
+from mountains.models.derivatives import enqueue_derivatives
+from mountains.models.image_files import (
+    ImageFile,
+    move_image_files,
+    source_image_files,
+    to_image_set,
+)
+from mountains.utils import now_utc, sharded_path
 
 if TYPE_CHECKING:
+    from typing import Iterable, Mapping
+
     from werkzeug.datastructures import FileStorage
 
 logger = logging.getLogger(__name__)
 
 
+# Relative to static
+UPLOADS_DIR = Path("uploads") / "photos"
+# Width of the photo shown on the site
+PHOTO_WIDTH = 1920
+# Smaller sizes, for thumbnails and srcsets, all made on upload
+THUMB_WIDTHS = [128, 300, 600, 1280]
+# Relative to static, shown until a thumbnail is ready
+PLACEHOLDER_PATH = Path("photo-placeholder.svg")
+# Photos whose perceptual hashes differ by at most this many bits (of 64) are
+# taken to be copies of the same shot
+NEAR_DUPLICATE_DISTANCE = 6
+# Claims on an upload older than this were left by a worker which died
+CLAIM_TIMEOUT_SECS = 120
+
+
 @define
 class Album:
     id: int
@@ -34,71 +63,246 @@ class Photo:
     uploader_id: int
     album_id: int
     starred: bool
-    # Relative to static (e.g. uploads/photos/...)
+    # Relative to static (e.g. uploads/photos/3f/a2/...), named by the hash of
+    # the original so photos with the same content share their files
     photo_path: Path
     created_at_utc: datetime.datetime = Factory(now_utc)
+    # See images.perceptual_hash. None for photos uploaded before these were taken.
+    perceptual_hash: int | None = None
 
-    def orig_path(self) -> Path | None:
-        static_dir = Path(current_app.config["STATIC_FOLDER"])
-        path = self.photo_path.with_stem(self.photo_path.stem + ".orig")
-        if (static_dir / path).exists():
+    def image_files(
+        self, files_by_source: Mapping[Path, list[ImageFile]] | None = None
+    ) -> list[ImageFile]:
+        """
+        Every file made from the photo. Pages showing many photos pass
+        `files_by_source` from `image_files_for`, to look them all up at once.
+        """
+        return source_image_files(self.photo_path, files_by_source)
+
+    def orig_path(
+        self, files_by_source: Mapping[Path, list[ImageFile]] | None = None
+    ) -> Path | None:
+        path = _orig_path(self.photo_path)
+        if any(f.path == path for f in self.image_files(files_by_source)):
             return path
         else:
             return None
 
-    def thumb_path(self, width=128) -> Path:
-        static_dir = Path(current_app.config["STATIC_FOLDER"])
-        path = self.photo_path.with_stem(self.photo_path.stem + f".th.{width}")
-        file_path = static_dir / path
-
-        static_photo_path = static_dir / self.photo_path
-        if not file_path.exists() and static_photo_path.exists():
-            # Create thumbnail for first time
-            with Image.open(static_photo_path) as im:
-                logger.info("Creating thumbnail for photo %s", self.id)
-                if im.width > width:
-                    new_height = int(im.height * (width / im.width))
-                    resized = im.resize((width, new_height))
-                    try:
-                        ImageOps.exif_transpose(resized, in_place=True)
-                    except Exception as e:
-                        logger.exception(
-                            "Exception while transposing newly uploadeed image.",
-                            exc_info=e,
-                        )
-                    resized.save(file_path)
-        return path
-
-
-def upload_photo(file: FileStorage, static_dir: Path, new_width: int = 1920) -> Path:
+    def thumb_path(
+        self,
+        width=128,
+        files_by_source: Mapping[Path, list[ImageFile]] | None = None,
+    ) -> Path:
+        """
+        The thumbnail if it's been made, otherwise a placeholder.
+
+        Thumbnails are made in the background (see `mountains.derivatives`), so a
+        missing one is queued rather than made during the render.
+        """
+        path = _thumb_path(self.photo_path, width)
+        if any(f.path == path for f in self.image_files(files_by_source)):
+            return path
+
+        if (self.photo_path, width) not in _queued_thumbs:
+            with db_conn() as conn:
+                enqueue_derivatives(conn, [self.photo_path], [width])
+            _queued_thumbs.add((self.photo_path, width))
+        return PLACEHOLDER_PATH
+
+    def image_set(
+        self,
+        fallback_width: int = PHOTO_WIDTH,
+        files_by_source: Mapping[Path, list[ImageFile]] | None = None,
+    ) -> images.ImageSet:
+        """
+        Every size and format of the photo made so far, for `<picture>` markup.
+        """
+        files = self.image_files(files_by_source)
+        if fallback_width == PHOTO_WIDTH:
+            fallback = self.photo_path
+        else:
+            fallback = self.thumb_path(fallback_width, {self.photo_path: files})
+        orig_path = _orig_path(self.photo_path)
+        return to_image_set(fallback, [f for f in files if f.path != orig_path])
+
+
+# Missing thumbnails this worker has already queued, to save queueing them again
+# on every render while they're waiting
+_queued_thumbs: set[tuple[Path, int]] = set()
+
+
+def _thumb_path(photo_path: Path, width: int) -> Path:
+    return photo_path.with_stem(photo_path.stem + f".th.{width}")
+
+
+def _sized_path(photo_path: Path, width: int) -> Path:
+    return photo_path if width == PHOTO_WIDTH else _thumb_path(photo_path, width)
+
+
+def make_derivative(static_dir: Path, photo_path: Path, width: int) -> list[ImageFile]:
+    """
+    Makes any copies of the photo at `width` which are missing, in every format.
+    The photo is never scaled up.
+
+    Returns all the copies at `width`, whether they were just made or not.
+    """
+    path = _sized_path(photo_path, width)
+    missing = []
+    saved = []
+    for format in images.ALL:
+        variant_path = static_dir / images.variant_path(path, format)
+        if variant_path.exists():
+            saved.append(images.describe(variant_path))
+        else:
+            missing.append(format)
+
+    if missing:
+        logger.info("Creating %spx copies of %s as %s", width, photo_path, missing)
+        saved.extend(
+            images.resize_widths(
+                static_dir / photo_path, {width: static_dir / path}, missing
+            )
+        )
+    return [ImageFile.from_saved(static_dir, photo_path, s) for s in saved]
+
+
+def save_upload(file: FileStorage, static_dir: Path) -> tuple[Path, bool]:
+    """
+    Saves the uploaded original. Returns where the resized photo should go, and
+    whether this saved the original, rather than finding it already there.
+
+    Uploads are named by the SHA-256 of their content, so if the same photo has
+    been uploaded before (to any album) this is where it already is.
+
+    Quick, so is done on the request thread before the slow `resize_photo`.
+    """
     assert file.filename is not None, (
-        "upload_photo should always have a file.filename attribute"
+        "save_upload should always have a file.filename attribute"
     )
-    random_str = str(uuid.uuid4())
-    file_type = Path(file.filename).suffix
-    filename = Path(random_str).with_suffix(file_type)
-    upload_path = static_dir / "uploads" / "photos" / filename
-
     logger.info("Handling photo upload %s...", file.filename)
+    upload_dir = static_dir / UPLOADS_DIR
+
+    # Hashed as it's written, as the name isn't known until the end
+    content_hash = hashlib.sha256()
+    tmp_path = upload_dir / f"{uuid.uuid4()}.tmp"
+    with tmp_path.open("wb") as f:
+        while chunk := file.stream.read(1024 * 1024):
+            content_hash.update(chunk)
+            f.write(chunk)
+
+    filename = Path(content_hash.hexdigest()).with_suffix(
+        Path(file.filename).suffix.lower()
+    )
+    photo_path = sharded_path(UPLOADS_DIR, filename)
+    orig_path = static_dir / _orig_path(photo_path)
+    if orig_path.exists():
+        tmp_path.unlink()
+        return photo_path, False
+    orig_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path.replace(orig_path)
+    return photo_path, True
 
-    # Save the original
-    orig_path = upload_path.with_stem(upload_path.stem + ".orig")
-    file.save(orig_path)
 
-    # Now resize the image using PIL
-    with Image.open(orig_path) as im:
-        if im.width > new_width:
-            new_height = int(im.height * (new_width / im.width))
-            resized = im.resize((new_width, new_height))
+def claim_upload(static_dir: Path, photo_path: Path) -> bool:
+    """
+    Claims the upload for resizing, so requests uploading the same photo at once
+    don't all resize it. Returns False if another request already has, in which
+    case wait for it with `wait_for_claim`. Release with `release_upload`.
+    """
+    lock_path = static_dir / _lock_path(photo_path)
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
             try:
-                ImageOps.exif_transpose(resized, in_place=True)
-            except Exception as e:
-                logger.exception(
-                    "Exception while transposing newly uploadeed image.", exc_info=e
-                )
-            resized.save(upload_path)
+                if time.time() - lock_path.stat().st_mtime < CLAIM_TIMEOUT_SECS:
+                    return False
+            except FileNotFoundError:
+                # Just released, so try again
+                continue
+            logger.warning("Taking over the stale claim on %s", photo_path)
+            lock_path.unlink(missing_ok=True)
+    return False
+
+
+def wait_for_claim(static_dir: Path, photo_path: Path) -> bool:
+    """
+    Waits for another request to finish resizing the upload. Returns whether it
+    succeeded, so the photo is ready to show.
+    """
+    lock_path = static_dir / _lock_path(photo_path)
+    deadline = time.monotonic() + CLAIM_TIMEOUT_SECS
+    while lock_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    return not lock_path.exists() and (static_dir / photo_path).exists()
+
+
+def release_upload(static_dir: Path, photo_path: Path) -> None:
+    (static_dir / _lock_path(photo_path)).unlink(missing_ok=True)
+
+
+def is_processed(photo_path: Path) -> bool:
+    """
+    Whether an upload with the same content has already been resized, so needn't
+    be again.
+    """
+    # Files are recorded once they've all been made
+    return bool(source_image_files(photo_path))
+
+
+def resize_photo(static_dir: Path, photo_path: Path) -> tuple[list[ImageFile], int]:
+    """
+    Makes the photo shown on the site, and its smaller copies in every format, from
+    its saved original. Returns all of them, along with the original, and the
+    photo's perceptual hash.
 
-    return Path("uploads") / "photos" / filename
+    Runs in a separate process (see `mountains.uploads`), so takes and returns only
+    picklable values.
+    """
+    orig_path = static_dir / _orig_path(photo_path)
+    saved = [images.describe(orig_path)]
+
+    # All come from the same decode, so needn't wait in the queue
+    targets = {
+        width: static_dir / _sized_path(photo_path, width)
+        for width in [*THUMB_WIDTHS, PHOTO_WIDTH]
+    }
+    saved.extend(images.resize_widths(orig_path, targets))
+
+    image_files = [ImageFile.from_saved(static_dir, photo_path, s) for s in saved]
+    # From the smallest copy, the quickest to read
+    return image_files, images.perceptual_hash(targets[min(targets)])
+
+
+def delete_upload(static_dir: Path, photo_path: Path) -> None:
+    """
+    Removes what's left of an upload that couldn't be processed. Only for uploads
+    whose original this request saved (see `save_upload`), as the files are
+    shared by every upload of the same photo.
+    """
+    for path in photo_file_paths(photo_path):
+        (static_dir / path).unlink(missing_ok=True)
+
+
+def photo_file_paths(photo_path: Path) -> list[Path]:
+    """
+    Everywhere a file made from the upload could be: its original, and every size
+    and format.
+    """
+    paths = [_orig_path(photo_path)]
+    for width in [*THUMB_WIDTHS, PHOTO_WIDTH]:
+        sized_path = _sized_path(photo_path, width)
+        paths.extend(images.variant_path(sized_path, f) for f in images.ALL)
+    return paths
+
+
+def _orig_path(photo_path: Path) -> Path:
+    return photo_path.with_stem(photo_path.stem + ".orig")
+
+
+def _lock_path(photo_path: Path) -> Path:
+    return photo_path.with_name(photo_path.stem + ".lock")
 
 
 def albums_repo(conn: sqlite3.Connection) -> Repository[Album]:
@@ -126,8 +330,192 @@ def photos_repo(conn: sqlite3.Connection) -> Repository[Photo]:
             "photo_path TEXT NOT NULL",
             "starred BOOLEAN NOT NULL",
             "created_at_utc DATETIME NOT NULL",
+            "perceptual_hash INTEGER",
             "FOREIGN KEY(uploader_id) REFERENCES users(id)",
             "FOREIGN KEY(album_id) REFERENCES albums(id)",
         ],
         storage_cls=Photo,
+        indexes=[
+            # An album's photos in upload order, without scanning every photo
+            "CREATE INDEX IF NOT EXISTS photos_album_id_created_at_utc"
+            " ON photos(album_id, created_at_utc)",
+            # Finds earlier uploads of the same content
+            "CREATE INDEX IF NOT EXISTS photos_photo_path ON photos(photo_path)",
+        ],
+    )
+
+
+def album_photos_page(
+    conn: sqlite3.Connection,
+    album_id: int,
+    limit: int,
+    after_id: int | None = None,
+    until_id: int | None = None,
+) -> list[Photo]:
+    """
+    Up to `limit` of an album's photos in upload order, starting after the photo
+    `after_id` (or from the first). If that photo has gone, it starts after the
+    one uploaded before it instead, or from the first if there's none. Photos with
+    ids from `until_id` on, i.e. those uploaded since the first page was shown, are
+    left out.
+
+    Pages are found by key rather than offset, so each is a short range of the
+    photos_album_id_created_at_utc index however far into the album it is.
+    """
+    params = {"album_id": album_id, "until_id": until_id}
+    where = "album_id = :album_id"
+    if after_id is not None:
+        after = conn.execute(
+            """
+            SELECT created_at_utc, id FROM photos
+            WHERE album_id = :album_id AND id <= :after_id
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            {"album_id": album_id, "after_id": after_id},
+        ).fetchone()
+        if after is not None:
+            where += " AND (created_at_utc, id) > (:after_created_at_utc, :after_id)"
+            params |= {"after_created_at_utc": after[0], "after_id": after[1]}
+    if until_id is not None:
+        where += " AND id < :until_id"
+
+    return photos_repo(conn).select(
+        where, params, order_by="created_at_utc, id", limit=limit
+    )
+
+
+def move_photo(
+    conn: sqlite3.Connection, photo_path: Path, new_photo_path: Path
+) -> None:
+    """
+    Points every photo, recorded file and queued copy of `photo_path` at
+    `new_photo_path`, where its files (named the same) are being moved to.
+    """
+    params = {"old": str(photo_path), "new": str(new_photo_path)}
+    conn.execute("UPDATE photos SET photo_path = :new WHERE photo_path = :old", params)
+    conn.execute(
+        "UPDATE derivative_jobs SET source_path = :new WHERE source_path = :old",
+        params,
+    )
+    move_image_files(conn, photo_path, new_photo_path)
+
+
+def find_duplicate(photo: Photo, others: Iterable[Photo]) -> Photo | None:
+    """
+    A photo in `others` with the same content as `photo`, or failing that one that
+    looks the same (e.g. resized or recompressed).
+    """
+    others = [o for o in others if o.id != photo.id]
+    for other in others:
+        if other.photo_path == photo.photo_path:
+            return other
+
+    if photo.perceptual_hash is None:
+        return None
+    for other in others:
+        if (
+            other.perceptual_hash is not None
+            and images.hash_distance(photo.perceptual_hash, other.perceptual_hash)
+            <= NEAR_DUPLICATE_DISTANCE
+        ):
+            return other
+    return None
+
+
+def adjacent_photos(
+    conn: sqlite3.Connection, photo: Photo
+) -> tuple[Photo | None, Photo | None]:
+    """
+    The photos before and after `photo` in its album, in upload order.
+
+    Each is one step along the photos_album_id_created_at_utc index, which ends
+    in the id (as it's the rowid), so costs the same however big the album.
+    """
+    # Compared with the photo's row as stored, rather than however the Python
+    # datetime would format it
+    position = "(SELECT created_at_utc, id FROM photos WHERE id = :id)"
+    params = {"album_id": photo.album_id, "id": photo.id}
+    photos_db = photos_repo(conn)
+    before = photos_db.select(
+        f"album_id = :album_id AND (created_at_utc, id) < {position}",
+        params,
+        order_by="created_at_utc DESC, id DESC",
+        limit=1,
+    )
+    after = photos_db.select(
+        f"album_id = :album_id AND (created_at_utc, id) > {position}",
+        params,
+        order_by="created_at_utc, id",
+        limit=1,
     )
+    return (before[0] if before else None, after[0] if after else None)
+
+
+@define(kw_only=True)
+class AlbumSummary:
+    """
+    What the album index shows of an album, without loading all its photos.
+    """
+
+    album: Album
+    num_photos: int
+    contributor_ids: list[int]
+    # Starred photos first, then the earliest
+    covers: list[Photo]
+
+
+_PHOTO_JSON = ", ".join(f"'{f.name}', {f.name}" for f in fields(Photo))
+
+# Only the albums on the page are aggregated, each through the
+# photos_album_id_created_at_utc index
+_ALBUM_SUMMARIES_QUERY = f"""
+    SELECT
+        page.*,
+        (
+            SELECT COUNT(*) FROM photos WHERE album_id = page.id
+        ) AS num_photos,
+        (
+            SELECT json_group_array(DISTINCT uploader_id)
+            FROM photos WHERE album_id = page.id
+        ) AS contributor_ids,
+        (
+            SELECT json_group_array(json_object({_PHOTO_JSON}))
+            FROM (
+                SELECT * FROM photos
+                WHERE album_id = page.id
+                ORDER BY starred DESC, created_at_utc, id
+                LIMIT :num_covers
+            )
+        ) AS covers
+    FROM (
+        SELECT * FROM albums
+        ORDER BY created_at_utc DESC, id DESC
+        LIMIT :limit OFFSET :offset
+    ) AS page
+    ORDER BY page.created_at_utc DESC, page.id DESC
+"""
+
+
+def album_summaries(
+    conn: sqlite3.Connection, limit: int, offset: int = 0, num_covers: int = 5
+) -> list[AlbumSummary]:
+    """
+    A page of albums, newest first, with their photo counts, contributors and
+    covers.
+    """
+    rows = conn.execute(
+        _ALBUM_SUMMARIES_QUERY,
+        {"limit": limit, "offset": offset, "num_covers": num_covers},
+    ).fetchall()
+
+    album_cols = [f.name for f in fields(Album)]
+    return [
+        AlbumSummary(
+            album=structure({c: row[c] for c in album_cols}, Album),
+            num_photos=row["num_photos"],
+            contributor_ids=sorted(json.loads(row["contributor_ids"])),
+            covers=structure(json.loads(row["covers"]), list[Photo]),
+        )
+        for row in rows
+    ]
@@ -6,6 +6,7 @@ import uuid
 from attrs import define
 
 from mountains.db import Repository
+from mountains.models.users import User
 from mountains.utils import now_utc
 
 
@@ -28,6 +29,39 @@ class AuthToken:
         return self.expiry_utc > now_utc()
 
 
+@define
+class SessionClaim:
+    """
+    Kept in the (signed) session cookie for stateless sessions, so we know who is
+    logged in without looking up a token.
+
+    Bumping the user's token_version revokes all of their claims.
+    """
+
+    user_id: int
+    issued_utc: datetime.datetime
+    token_version: int
+
+    @classmethod
+    def for_user(cls, user: User):
+        return cls(
+            user_id=user.id, issued_utc=now_utc(), token_version=user.token_version
+        )
+
+    def is_valid_for(self, user: User, valid_days: int = 30) -> bool:
+        return (
+            self.user_id == user.id
+            and self.token_version == user.token_version
+            and self.issued_utc + datetime.timedelta(days=valid_days) > now_utc()
+        )
+
+
+def revoke_session_claims(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute(
+        "UPDATE users SET token_version = token_version + 1 WHERE id = ?", (user_id,)
+    )
+
+
 def tokens_repo(conn: sqlite3.Connection) -> Repository[AuthToken]:
     return Repository(
         conn=conn,
@@ -39,7 +73,53 @@ def tokens_repo(conn: sqlite3.Connection) -> Repository[AuthToken]:
             "FOREIGN KEY(user_id) REFERENCES users(id)",
         ],
         storage_cls=AuthToken,
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS tokens_user_id ON tokens(user_id)",
+            "CREATE INDEX IF NOT EXISTS tokens_expiry_utc ON tokens(expiry_utc)",
+        ],
+    )
+
+
+def prune_user_tokens(conn: sqlite3.Connection, user_id: int, keep: int) -> int:
+    """
+    Deletes a user's expired tokens, and any beyond the `keep` newest.
+
+    Returns how many were deleted.
+    """
+    cur = conn.execute(
+        """
+        DELETE FROM tokens
+        WHERE user_id = :user_id AND (
+            expiry_utc <= :now
+            OR id IN (
+                SELECT id FROM tokens
+                WHERE user_id = :user_id
+                ORDER BY expiry_utc DESC
+                LIMIT -1 OFFSET :keep
+            )
+        )
+        """,
+        {"user_id": user_id, "now": now_utc().isoformat(), "keep": keep},
+    )
+    return cur.rowcount
+
+
+def delete_expired_tokens(conn: sqlite3.Connection, batch_size: int) -> int:
+    """
+    Deletes up to `batch_size` expired tokens, so the write lock is only held
+    briefly.
+
+    Returns how many were deleted.
+    """
+    cur = conn.execute(
+        """
+        DELETE FROM tokens WHERE id IN (
+            SELECT id FROM tokens WHERE expiry_utc <= :now LIMIT :batch_size
+        )
+        """,
+        {"now": now_utc().isoformat(), "batch_size": batch_size},
     )
+    return cur.rowcount
 
 
 @define
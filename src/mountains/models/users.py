@@ -8,14 +8,20 @@ from typing import TYPE_CHECKING
 
 from attrs import Factory, define, field
 from flask import abort
-from PIL import Image, ImageOps
 
+from mountains import images
 from mountains.db import Repository
 from mountains.errors import ValidationError
-from mountains.utils import now_utc, readable_id
+from mountains.models.image_files import (
+    ImageFile,
+    move_image_files,
+    source_image_files,
+    to_image_set,
+)
+from mountains.utils import now_utc, readable_id, sharded_path
 
 if TYPE_CHECKING:
-    from typing import Self
+    from typing import Mapping, Self
 
     from werkzeug.datastructures import FileStorage
 
@@ -52,6 +58,8 @@ class User:
     last_login_utc: datetime.datetime | None = None
     committee_role: CommitteeRole | None = None
     committee_bio: str = ""
+    # Bumped to revoke any stateless sessions (see SessionClaim)
+    token_version: int = 0
 
     def __str__(self):
         return f"{self.full_name} ({self.email})"
@@ -66,6 +74,18 @@ class User:
             return None
         return _thumb_path(Path(self.profile_picture_url))
 
+    def profile_image_set(
+        self, files_by_source: Mapping[Path, list[ImageFile]] | None = None
+    ) -> images.ImageSet | None:
+        """
+        Every size and format of the profile picture made so far. Pages showing
+        many pass `files_by_source` from `image_files_for`.
+        """
+        if self.profile_picture_url is None:
+            return None
+        path = Path(self.profile_picture_url)
+        return to_image_set(path, source_image_files(path, files_by_source))
+
     @property
     def is_member(self) -> bool:
         if self.membership_expiry is None:
@@ -80,6 +100,18 @@ class User:
     def is_site_admin(self) -> bool:
         return self.is_coordinator or self.is_committee or self.is_admin
 
+    @property
+    def role_class(self) -> str:
+        """
+        The broad group of users this is in, for caching what each group sees.
+        """
+        if self.is_site_admin:
+            return "admin"
+        elif self.is_member:
+            return "member"
+        else:
+            return "guest"
+
     def is_executive_committee(self) -> bool:
         return self.committee_role in [
             CommitteeRole.CHAIR,
@@ -178,37 +210,77 @@ def users_repo(conn: sqlite3.Connection) -> Repository[User]:
             "committee_bio INTEGER NOT NULL",
             "created_on_utc DATETIME NOT NULL",
             "last_login_utc DATETIME",
+            "token_version INTEGER NOT NULL DEFAULT 0",
         ],
         storage_cls=User,
     )
 
 
 def upload_profile(
-    file: FileStorage,
-    static_dir: Path,
-    user: User,
-    size: int = 512,
-    th_size: int = 32,
-) -> str:
+    file: FileStorage, static_dir: Path, user: User
+) -> tuple[str, list[ImageFile]]:
+    """
+    Saves the picture, and its smaller copies. Returns its path (relative to
+    static) and the files made, to record with it.
+    """
     assert file.filename is not None, (
         "upload_profile should always have a file.filename attribute"
     )
-    filename = Path(user.slug).with_suffix(Path(file.filename).suffix)
-    upload_path = static_dir / "profile" / filename
+    profile_path = sharded_path(
+        PROFILE_DIR, Path(user.slug).with_suffix(Path(file.filename).suffix)
+    )
+    upload_path = static_dir / profile_path
+    upload_path.parent.mkdir(parents=True, exist_ok=True)
     file.save(upload_path)
 
-    # Now resize the image using PIL
-    with Image.open(upload_path) as im:
-        # fit will center and crop
-        resized = ImageOps.fit(im, (size, size))
-        thumb = ImageOps.fit(im, (th_size, th_size))
-        ImageOps.exif_transpose(resized, in_place=True)
-        ImageOps.exif_transpose(thumb, in_place=True)
+    # Centered and cropped to squares, the largest replacing the upload
+    saved = images.fit_squares(
+        upload_path, {size: _sized_path(upload_path, size) for size in PROFILE_SIZES}
+    )
+
+    return str(profile_path), [
+        ImageFile.from_saved(static_dir, profile_path, s) for s in saved
+    ]
 
-        resized.save(upload_path)
-        thumb.save(_thumb_path(upload_path))
 
-    return str(Path("profile") / filename)
+# Relative to static
+PROFILE_DIR = Path("profile")
+# Sizes of the square profile pictures, the largest at profile_picture_url
+PROFILE_SIZES = [32, 64, 128, 256, 512]
+
+
+def move_profile(conn: sqlite3.Connection, user: User, new_profile_path: Path) -> None:
+    """
+    Points the user's profile picture, and its recorded files, at
+    `new_profile_path`, where its files (named the same) are being moved to. The
+    user is left alone if they've since uploaded a new picture.
+    """
+    assert user.profile_picture_url is not None
+    users_repo(conn).update(
+        _where={"id": user.id, "profile_picture_url": user.profile_picture_url},
+        profile_picture_url=str(new_profile_path),
+    )
+    move_image_files(conn, Path(user.profile_picture_url), new_profile_path)
+
+
+def profile_file_paths(profile_path: Path) -> list[Path]:
+    """
+    Everywhere a file made from the uploaded picture could be.
+    """
+    return [
+        images.variant_path(_sized_path(profile_path, size), f)
+        for size in PROFILE_SIZES
+        for f in images.ALL
+    ]
+
+
+def _sized_path(profile_path: Path, size: int) -> Path:
+    if size == max(PROFILE_SIZES):
+        return profile_path
+    elif size == 32:
+        return _thumb_path(profile_path)
+    else:
+        return profile_path.with_stem(profile_path.stem + f".{size}")
 
 
 def _thumb_path(profile_path: Path) -> Path:
@@ -0,0 +1,105 @@
+"""
+Password hashing, kept off the request threads.
+
+Hashing (scrypt by default) takes tens of MB of memory and a lot of CPU, so each
+worker only runs a couple at once on a small executor. If too many are waiting,
+new ones are turned away rather than queueing up behind them.
+"""
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from attrs import define, field
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from mountains.cache import LRUCache
+from mountains.errors import MountainException
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Self
+
+    from flask import Config
+
+
+@define
+class PasswordHasher:
+    # Anything werkzeug's generate_password_hash accepts, e.g. "scrypt:16384:8:1"
+    method: str
+    max_workers: int
+    max_queued: int
+    _executor: ThreadPoolExecutor = field(init=False)
+    _slots: threading.BoundedSemaphore = field(init=False)
+    # How hashes with `method` start, to spot ones made some other way. Found by
+    # hashing, so it's only worked out once it's first needed
+    _prefix: str | None = field(init=False, default=None)
+
+    def __attrs_post_init__(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="password"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queued)
+
+    @classmethod
+    def from_config(cls, config: Config) -> Self:
+        return cls(
+            method=config["CMC_PASSWORD_METHOD"],
+            max_workers=config["CMC_PASSWORD_WORKERS"],
+            max_queued=config["CMC_PASSWORD_QUEUED"],
+        )
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Whether the hash was made with a different method or cost to ours.
+        Returns False if we're too busy to work that out right now.
+        """
+        if self._prefix is None:
+            try:
+                self._prefix = self.hash("").split("$", 1)[0]
+            except MountainException:
+                return False
+        return password_hash.split("$", 1)[0] != self._prefix
+
+    def _run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        if not self._slots.acquire(blocking=False):
+            raise MountainException(
+                "The site is busy right now - please try again in a minute."
+            )
+        try:
+            return self._executor.submit(func, *args, **kwargs).result()
+        finally:
+            self._slots.release()
+
+
+@define
+class AttemptLimiter:
+    """
+    Counts failed attempts per key (e.g. an email or IP address), blocking a key
+    once it has `max_attempts` within `window_secs` of each other.
+
+    Counts are per worker, so across gunicorn the real limit is a few times higher.
+    """
+
+    name: str
+    max_attempts: int
+    window_secs: float
+    _failures: LRUCache[str, int] = field(init=False)
+
+    def __attrs_post_init__(self):
+        self._failures = LRUCache(
+            name=self.name, max_size=10_000, ttl_secs=self.window_secs
+        )
+
+    def is_blocked(self, key: str) -> bool:
+        return (self._failures.get(key) or 0) >= self.max_attempts
+
+    def record_failure(self, key: str) -> None:
+        self._failures.set(key, (self._failures.get(key) or 0) + 1)
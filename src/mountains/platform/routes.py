@@ -8,15 +8,19 @@ from flask import (
     redirect,
     render_template,
     request,
-    session,
     url_for,
 )
 
 from mountains import albums, committee, events, kit, members
-from mountains.context import current_user, db_conn
+from mountains.context import (
+    current_user,
+    db_conn,
+    end_session,
+    get_session_user,
+    is_logged_in,
+)
 from mountains.errors import MountainException
-from mountains.models.pages import latest_content
-from mountains.models.tokens import tokens_repo
+from mountains.models.pages import latest_content, latest_contents
 from mountains.models.users import users_repo
 from mountains.payments import MembershipPaymentMetadata, StripeAPI
 
@@ -29,28 +33,19 @@ def routes(blueprint: Blueprint):
         logon_url_with_redirect = _hard_redirect(
             url_for("auth.login", redirect=request.path)
         )
-        if (token_id := session.get("token_id")) is None:
+        if not is_logged_in():
             return logon_url_with_redirect
-        else:
-            with db_conn() as conn:
-                token = tokens_repo(conn).get(id=token_id)
-                if token is None:
-                    # Something weird happened
-                    del session["token_id"]
-                    return logon_url_with_redirect
-
-                user = users_repo(conn).get(id=token.user_id)
-                if user is None:
-                    # Something weird happened
-                    del session["token_id"]
-                    return logon_url_with_redirect
-                elif (
-                    user.is_dormant
-                    and request.endpoint
-                    and not request.endpoint.endswith("dormant")
-                ):
-                    # Needs to be absolute as wont necesarily be called from within this app
-                    return _hard_redirect(url_for("platform.dormant"))
+        elif (user := get_session_user()) is None:
+            # Something weird happened, or their session has expired
+            end_session()
+            return logon_url_with_redirect
+        elif (
+            user.is_dormant
+            and request.endpoint
+            and not request.endpoint.endswith("dormant")
+        ):
+            # Needs to be absolute as wont necesarily be called from within this app
+            return _hard_redirect(url_for("platform.dormant"))
 
     @blueprint.route("/dormant/", methods=["GET", "POST"])
     def dormant():
@@ -76,18 +71,17 @@ def routes(blueprint: Blueprint):
         }
         if page is None:
             with db_conn() as conn:
-                bullet_pages = {
-                    c: latest_content(conn, f"bullet-{c}")
-                    for c in (
-                        "day-walks",
-                        "hut-weekends",
-                        "indoor-climbing",
-                        "outdoor-climbing",
-                        "running",
-                        "winter",
-                        "socials",
-                    )
-                }
+                bullets = (
+                    "day-walks",
+                    "hut-weekends",
+                    "indoor-climbing",
+                    "outdoor-climbing",
+                    "running",
+                    "winter",
+                    "socials",
+                )
+                contents = latest_contents(conn, [f"bullet-{c}" for c in bullets])
+                bullet_pages = {c: contents[f"bullet-{c}"] for c in bullets}
             return render_template("platform/home.html.j2", bullet_pages=bullet_pages)
         elif page in info_pages:
             with db_conn() as conn:
@@ -0,0 +1,58 @@
+"""
+Clears expired auth tokens in the background.
+
+Each gunicorn worker runs its own sweeper at a random offset, so they don't all
+sweep at once. Sweeps are safe to overlap, as they only delete expired tokens.
+"""
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from mountains.db import connection
+from mountains.models.tokens import delete_expired_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def start_token_sweeper(
+    db_name: str, interval_secs: float, batch_size: int = 500
+) -> threading.Thread:
+    thread = threading.Thread(
+        target=_sweep_forever,
+        args=(db_name, interval_secs, batch_size),
+        name="token-sweeper",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def sweep_expired_tokens(db_name: str, batch_size: int = 500) -> int:
+    """
+    Deletes all expired tokens, a batch at a time. Returns how many were deleted.
+    """
+    total = 0
+    while True:
+        with connection(db_name) as conn:
+            deleted = delete_expired_tokens(conn, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            break
+        # Let any requests waiting to write in between batches
+        time.sleep(0.1)
+
+    if total > 0:
+        logger.info("Swept %s expired tokens", total)
+    return total
+
+
+def _sweep_forever(db_name: str, interval_secs: float, batch_size: int) -> None:
+    while True:
+        time.sleep(random.uniform(0.5, 1.5) * interval_secs)
+        try:
+            sweep_expired_tokens(db_name, batch_size)
+        except sqlite3.Error:
+            logger.exception("Failed to sweep expired tokens")
@@ -0,0 +1,173 @@
+"""
+Processes uploaded photos in parallel, off the request thread.
+
+Decoding and resizing a photo takes most of a second of CPU, so a batch of them
+is spread over a pool of processes (threads would be held back by the GIL). The
+pool is only started on the first upload, as most workers never see one.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+from attrs import Factory, define, field, frozen
+
+from mountains.models.photos import (
+    claim_upload,
+    delete_upload,
+    is_processed,
+    release_upload,
+    resize_photo,
+    save_upload,
+    wait_for_claim,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Self
+
+    from flask import Config
+    from werkzeug.datastructures import FileStorage
+
+    from mountains.models.image_files import ImageFile
+
+logger = logging.getLogger(__name__)
+
+
+@frozen
+class UploadResult:
+    filename: str
+    # Relative to static, or None if it failed
+    photo_path: Path | None
+    error: str | None = None
+    # Everything made from it, to record with the photo. Empty if the same photo
+    # had already been uploaded, so wasn't processed again.
+    image_files: list[ImageFile] = Factory(list)
+    perceptual_hash: int | None = None
+
+
+@define
+class PhotoProcessor:
+    max_workers: int
+    _executor: ProcessPoolExecutor | None = field(init=False, default=None)
+    _lock: threading.Lock = field(init=False, factory=threading.Lock)
+
+    @classmethod
+    def from_config(cls, config: Config) -> Self:
+        # By default the workers between them have one process per core, so that
+        # uploads to every worker at once don't each decode a photo per core
+        max_workers = config["CMC_PHOTO_PROCESSES"] or max(
+            1, (os.cpu_count() or 1) // config["CMC_WEB_WORKERS"]
+        )
+        return cls(max_workers=max_workers)
+
+    def process(self, files: list[FileStorage], static_dir: Path) -> list[UploadResult]:
+        """
+        Saves and resizes every file, in the same order. A file that fails doesn't
+        stop the rest, but gets an error in its result instead. Photos which have
+        been uploaded before aren't resized again.
+        """
+        saved: list[tuple[str, Path | None, str | None]] = []
+        # Those whose originals this saved, so are ours to delete if they fail
+        created: set[Path] = set()
+        for file in files:
+            filename = file.filename or "photo"
+            try:
+                photo_path, is_new = save_upload(file, static_dir)
+            except OSError:
+                logger.exception("Failed saving upload %s", filename)
+                saved.append((filename, None, f"Couldn't save {filename}"))
+                continue
+            saved.append((filename, photo_path, None))
+            if is_new:
+                created.add(photo_path)
+
+        # Each photo is only processed once, even if uploaded again or twice at
+        # once, by whichever request claims it first
+        to_process = {
+            photo_path
+            for _, photo_path, _ in saved
+            if photo_path is not None and not is_processed(photo_path)
+        }
+        claimed = {p for p in to_process if claim_upload(static_dir, p)}
+        try:
+            return self._process_claimed(
+                saved, to_process, claimed, created, static_dir
+            )
+        finally:
+            for photo_path in claimed:
+                release_upload(static_dir, photo_path)
+
+    def _process_claimed(
+        self,
+        saved: list[tuple[str, Path | None, str | None]],
+        to_process: set[Path],
+        claimed: set[Path],
+        created: set[Path],
+        static_dir: Path,
+    ) -> list[UploadResult]:
+        futures: dict[Path, Future] = {}
+        if claimed:
+            executor = self._get_executor()
+            for photo_path in claimed:
+                futures[photo_path] = executor.submit(
+                    resize_photo, static_dir, photo_path
+                )
+        # Those being processed by another request
+        ready = {p: wait_for_claim(static_dir, p) for p in to_process - claimed}
+
+        results = []
+        for filename, photo_path, error in saved:
+            if photo_path is None:
+                results.append(UploadResult(filename, None, error))
+                continue
+            if (future := futures.get(photo_path)) is None:
+                if ready.get(photo_path, True):
+                    results.append(UploadResult(filename, photo_path))
+                else:
+                    error = f"Couldn't process {filename}"
+                    results.append(UploadResult(filename, None, error))
+                continue
+
+            try:
+                image_files, perceptual_hash = future.result()
+                results.append(
+                    UploadResult(
+                        filename, photo_path, None, image_files, perceptual_hash
+                    )
+                )
+                continue
+            except BrokenProcessPool:
+                logger.exception("Photo processing pool died on %s", filename)
+                self._reset_executor(executor)
+                error = f"Couldn't process {filename}"
+            except Exception:
+                logger.exception("Failed processing upload %s", filename)
+                error = f"{filename} isn't a photo we can read"
+
+            if photo_path in created:
+                delete_upload(static_dir, photo_path)
+            results.append(UploadResult(filename, None, error))
+        return results
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Not forked, as the app has other threads running (e.g. sweepers)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
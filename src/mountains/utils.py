@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
 import re
 import unicodedata
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from pathlib import Path
+
     from werkzeug import Request
 
 
@@ -30,6 +33,17 @@ def slugify(value: str) -> str:
     return re.sub(r"[-\s]+", "-", value)
 
 
+def sharded_path(directory: Path, filename: Path) -> Path:
+    """
+    Where `filename` goes under `directory`, two levels of subdirectories down
+    (e.g. directory/3f/a2/filename), so no one directory grows too big to list
+    quickly. The subdirectories come from a hash of the name's stem, so files are
+    spread evenly, and files which differ only in suffix end up together.
+    """
+    digest = hashlib.sha256(filename.stem.encode()).hexdigest()
+    return directory / digest[:2] / digest[2:4] / filename
+
+
 def req_method(request: Request) -> str:
     if "method" in request.form and request.method == "POST":
         # Use the hidden METHOD form field to set the request
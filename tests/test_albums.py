@@ -0,0 +1,129 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from mountains.albums import _gallery_page
+from mountains.db import connection
+from mountains.models.photos import (
+    Album,
+    Photo,
+    adjacent_photos,
+    album_photos_page,
+    albums_repo,
+    photos_repo,
+)
+from mountains.models.users import User, users_repo
+
+
+@pytest.fixture
+def conn(tmp_path):
+    with connection(str(tmp_path / "test.db")) as conn:
+        for repo in (users_repo, albums_repo, photos_repo):
+            repo(conn).create_table()
+        users_repo(conn).insert(
+            User(
+                id=1,
+                slug="user-1",
+                email="u1@example.org",
+                password_hash="x",
+                first_name="First",
+                last_name="Last",
+                about=None,
+            )
+        )
+        for album_id in (1, 2):
+            albums_repo(conn).insert(Album(id=album_id, name="Album", event_date=None))
+        yield conn
+
+
+def add_photos(conn, album_id: int, ids: list[int]) -> None:
+    start = datetime.datetime(2025, 1, 1)
+    for i in ids:
+        photos_repo(conn).insert(
+            Photo(
+                id=i,
+                uploader_id=1,
+                album_id=album_id,
+                starred=False,
+                photo_path=Path(f"uploads/photos/p{i}.jpg"),
+                created_at_utc=start + datetime.timedelta(minutes=i),
+            )
+        )
+
+
+def page_ids(conn, album_id: int, limit: int, after_id=None, until_id=None):
+    return [p.id for p in album_photos_page(conn, album_id, limit, after_id, until_id)]
+
+
+def test_photos_page_in_upload_order(conn):
+    add_photos(conn, 1, [3, 1, 2, 5, 4])
+    add_photos(conn, 2, [6, 7])
+    assert page_ids(conn, 1, 2) == [1, 2]
+    assert page_ids(conn, 1, 2, after_id=2) == [3, 4]
+    assert page_ids(conn, 1, 2, after_id=4) == [5]
+    assert page_ids(conn, 1, 2, after_id=5) == []
+
+
+def test_photos_page_leaves_out_later_uploads(conn):
+    add_photos(conn, 1, [1, 2, 3, 4])
+    assert page_ids(conn, 1, 10, after_id=1, until_id=3) == [2]
+
+
+def test_photos_page_after_deleted_photo(conn):
+    add_photos(conn, 1, [1, 2, 3, 4])
+    photos_repo(conn).delete_where(id=2)
+    assert page_ids(conn, 1, 10, after_id=2) == [3, 4]
+
+
+def test_photos_page_after_photo_in_other_album(conn):
+    add_photos(conn, 1, [1, 3])
+    add_photos(conn, 2, [2])
+    assert page_ids(conn, 1, 10, after_id=2) == [3]
+
+
+def test_photos_page_after_every_earlier_photo_deleted(conn):
+    add_photos(conn, 1, [1, 2, 3])
+    photos_repo(conn).delete_where(id=1)
+    assert page_ids(conn, 1, 10, after_id=1) == [2, 3]
+
+
+def test_adjacent_photos(conn):
+    add_photos(conn, 1, [1, 3, 4])
+    add_photos(conn, 2, [2])
+    photos = {p.id: p for p in photos_repo(conn).list()}
+    assert adjacent_photos(conn, photos[3]) == (photos[1], photos[4])
+    assert adjacent_photos(conn, photos[1]) == (None, photos[3])
+    assert adjacent_photos(conn, photos[2]) == (None, None)
+
+
+def test_gallery_page_empty_album(conn):
+    gallery = _gallery_page(conn, Album(id=1, name="Album", event_date=None), 20)
+    assert gallery["photos"] == []
+    assert not gallery["has_more"]
+    assert gallery["num_shown"] == 0
+
+
+@pytest.mark.parametrize("limit", [0, -1, -100])
+def test_gallery_page_shows_a_photo_for_any_limit(conn, limit):
+    add_photos(conn, 1, [1, 2, 3])
+    gallery = _gallery_page(conn, Album(id=1, name="Album", event_date=None), limit)
+    assert [p.id for p in gallery["photos"]] == [1]
+    assert gallery["has_more"]
+    assert gallery["num_shown"] == 1
+
+
+def test_gallery_page_counts_photos_shown(conn):
+    add_photos(conn, 1, [1, 2, 3, 4, 5])
+    album = Album(id=1, name="Album", event_date=None)
+    first = _gallery_page(conn, album, 2)
+    assert [p.id for p in first["photos"]] == [1, 2]
+    assert first["has_more"]
+
+    last = _gallery_page(
+        conn, album, 3, after_id=first["photos"][-1].id, num_shown=first["num_shown"]
+    )
+    assert [p.id for p in last["photos"]] == [3, 4, 5]
+    assert not last["has_more"]
+    assert last["num_shown"] == 5
+    assert set(last["uploaders"]) == {1}
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from mountains import images
+from mountains.models.photos import (
+    NEAR_DUPLICATE_DISTANCE,
+    Photo,
+    claim_upload,
+    find_duplicate,
+    release_upload,
+)
+
+
+def make_photo(id: int, photo_path: str, perceptual_hash: int | None) -> Photo:
+    return Photo(
+        id=id,
+        uploader_id=1,
+        album_id=1,
+        starred=False,
+        photo_path=Path(photo_path),
+        perceptual_hash=perceptual_hash,
+    )
+
+
+def test_hash_distance():
+    assert images.hash_distance(0, 0) == 0
+    assert images.hash_distance(0b1011, 0b0001) == 2
+    # Hashes are signed 64-bit, so the top bit is the sign
+    assert images.hash_distance(-1, 0) == 64
+    assert images.hash_distance(-(2**63), 2**63 - 1) == 64
+
+
+def test_perceptual_hash_survives_resizing(tmp_path):
+    im = Image.new("RGB", (1200, 800), "white")
+    draw = ImageDraw.Draw(im)
+    draw.ellipse((100, 100, 700, 600), fill="navy")
+    draw.rectangle((800, 200, 1100, 700), fill="firebrick")
+    im.save(tmp_path / "big.jpg", quality=90)
+    im.resize((300, 200)).save(tmp_path / "small.jpg", quality=60)
+    im.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(tmp_path / "flipped.jpg")
+
+    big = images.perceptual_hash(tmp_path / "big.jpg")
+    small = images.perceptual_hash(tmp_path / "small.jpg")
+    flipped = images.perceptual_hash(tmp_path / "flipped.jpg")
+    assert images.hash_distance(big, small) <= NEAR_DUPLICATE_DISTANCE
+    assert images.hash_distance(big, flipped) > NEAR_DUPLICATE_DISTANCE
+
+
+def test_find_duplicate_same_content():
+    photo = make_photo(3, "a.jpg", None)
+    others = [make_photo(1, "b.jpg", None), make_photo(2, "a.jpg", None)]
+    assert find_duplicate(photo, others) == others[1]
+
+
+def test_find_duplicate_prefers_same_content():
+    photo = make_photo(3, "a.jpg", 0)
+    others = [make_photo(1, "b.jpg", 1), make_photo(2, "a.jpg", 2**40)]
+    assert find_duplicate(photo, others) == others[1]
+
+
+def test_find_duplicate_looks_alike():
+    photo = make_photo(3, "a.jpg", 0)
+    near = make_photo(1, "b.jpg", (1 << NEAR_DUPLICATE_DISTANCE) - 1)
+    far = make_photo(2, "c.jpg", (1 << NEAR_DUPLICATE_DISTANCE + 1) - 1)
+    assert find_duplicate(photo, [far, near]) == near
+    assert find_duplicate(photo, [far]) is None
+
+
+def test_find_duplicate_ignores_itself_and_missing_hashes():
+    photo = make_photo(1, "a.jpg", 0)
+    assert find_duplicate(photo, [photo, make_photo(2, "b.jpg", None)]) is None
+    assert find_duplicate(make_photo(3, "c.jpg", None), [photo]) is None
+
+
+def test_claim_upload(tmp_path):
+    photo_path = Path("a.jpg")
+    assert claim_upload(tmp_path, photo_path)
+    assert not claim_upload(tmp_path, photo_path)
+    release_upload(tmp_path, photo_path)
+    assert claim_upload(tmp_path, photo_path)
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from mountains.utils import sharded_path
+
+
+def test_sharded_path_is_two_levels_down():
+    path = sharded_path(Path("uploads/photos"), Path("abc.jpg"))
+    assert path.name == "abc.jpg"
+    assert path.parent.parent.parent == Path("uploads/photos")
+    assert all(len(part) == 2 for part in path.parent.parts[-2:])
+
+
+def test_sharded_path_is_stable():
+    directory = Path("uploads/photos")
+    assert sharded_path(directory, Path("abc.jpg")) == sharded_path(
+        directory, Path("abc.jpg")
+    )
+
+
+def test_sharded_path_keeps_suffixes_together():
+    directory = Path("profile")
+    jpg = sharded_path(directory, Path("abc.jpg"))
+    webp = sharded_path(directory, Path("abc.webp"))
+    assert jpg.parent == webp.parent
+    assert sharded_path(directory, Path("abd.jpg")).parent != jpg.parent
+
+
+def test_sharded_path_spreads_files():
+    directory = Path("uploads/photos")
+    parents = {sharded_path(directory, Path(f"{i}.jpg")).parent for i in range(1000)}
+    # 1000 names into 65536 directories should rarely collide
+    assert len(parents) > 980